@@ -1,13 +1,35 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 import jwt
 import datetime
 import os
 import csv
 import io
+import hashlib
+import tempfile
+import threading
+import time
+import uuid
+import json
+import re
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+import psycopg2
 import requests
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+except ImportError: # o parser colunar é opcional; sem pyarrow o upload é lido com csv.DictReader
+    pa = None
+
 app = Flask(__name__)
 CORS(app)  # Habilitar CORS para todas as rotas, permitindo que o frontend acesse o backend 1 sem problemas de CORS
 
@@ -15,6 +37,9 @@ CORS(app)  # Habilitar CORS para todas as rotas, permitindo que o frontend acess
 JWT_SECRET = os.getenv('JWT_SECRET', 'sua-chave-secreta-super-segura-aqui')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '1024')) # tokens já verificados mantidos em memória (0 desativa o cache)
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_TTL_SECONDS', '300')) # tempo máximo de um token no cache (nunca passa do exp)
+DATABASE_URL = os.getenv('DATABASE_URL') # revogações também vão para auth.revoked_tokens, lida pelo backend2-api; vazia: só valem aqui
 
 # Credenciais fixas em memória
 FIXED_USERNAME = 'admin'
@@ -22,6 +47,116 @@ FIXED_PASSWORD = 'admin123'
 
 # URL do pipeline (para disparar a ingestão)
 PIPELINE_URL = os.getenv('PIPELINE_URL', 'http://pipeline:8080/trigger') # se não existir, usa o segundo valor
+UPLOAD_BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', '10000')) # pedidos enviados ao pipeline por requisição no upload de CSV
+PIPELINE_UPLOAD_FORMAT = os.getenv('PIPELINE_UPLOAD_FORMAT', 'binary') # binary (application/x-orders-binary) ou json
+PIPELINE_CONTENT_TYPES = {'binary': 'application/x-orders-binary', 'json': 'application/json'}
+BINARY_MAGIC = b'ORDB\x01' # início de todo corpo binário: assinatura + versão do formato
+CSV_ENGINE = os.getenv('CSV_ENGINE', 'auto') # auto (pyarrow se instalado), arrow ou python
+CSV_BLOCK_SIZE = int(os.getenv('CSV_BLOCK_SIZE', str(4 * 1024 * 1024))) # bytes lidos por bloco no parser colunar
+ORDER_COLUMNS = ['order_id', 'created_at', 'status', 'value', 'payment_method']
+VALUE_PATTERN = r'[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?' # value aceito, depois de trocar a vírgula decimal por ponto (mesma regra do data-source)
+
+# Transformer: o job só termina quando a agregação dos pedidos inseridos terminou (ver wait_for_transform)
+TRANSFORMER_URL = os.getenv('TRANSFORMER_URL', 'http://transformer:8080/transform') # mesmo endpoint chamado pelo pipeline; o estado fica em <url>/runs/<id>
+TRANSFORM_WAIT_SECONDS = float(os.getenv('TRANSFORM_WAIT_SECONDS', '300')) # espera máxima pela transformação antes de o job falhar
+TRANSFORM_POLL_SECONDS = float(os.getenv('TRANSFORM_POLL_SECONDS', '1')) # intervalo entre consultas ao estado da transformação
+
+# Jobs de sincronização: executados em segundo plano por um pool limitado de threads
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', '2')) # quantos jobs falam com o pipeline ao mesmo tempo
+SYNC_JOB_TTL_SECONDS = int(os.getenv('SYNC_JOB_TTL_SECONDS', '3600')) # por quanto tempo um job finalizado continua consultável
+sync_executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix='sync-job')
+sync_jobs = {} # job_id -> estado do job
+active_sync_jobs = {} # chave de coalescência -> job_id ainda na fila ou rodando
+sync_jobs_lock = threading.Lock()
+
+# Métricas Prometheus expostas em /metrics
+PIPELINE_SECONDS = Histogram('backend1_pipeline_request_seconds', 'Latência das chamadas ao pipeline', ['kind'], buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+CSV_PARSE_SECONDS = Histogram('backend1_csv_parse_seconds', 'Tempo lendo e validando o CSV enviado, por upload')
+CSV_ROWS = Counter('backend1_csv_rows_total', 'Pedidos válidos lidos de CSVs enviados')
+CSV_PARSE_ROWS_PER_SECOND = Gauge('backend1_csv_parse_rows_per_second', 'Vazão de leitura do CSV no último upload')
+SYNC_JOB_SECONDS = Histogram('backend1_sync_job_seconds', 'Duração dos jobs de sincronização', ['kind', 'state'], buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+SYNC_JOB_QUEUE_SECONDS = Histogram('backend1_sync_job_queue_seconds', 'Tempo dos jobs na fila antes de rodar', ['kind'])
+TOKEN_CACHE_REQUESTS = Counter('backend1_token_cache_requests_total', 'Consultas ao cache de tokens verificados', ['result'])
+
+
+class TokenCache:
+    """Cache LRU dos tokens JWT já verificados, com lista de revogação.
+
+    A chave é o SHA-256 do token (o token em si não fica em memória). Cada entrada vale até
+    TOKEN_CACHE_TTL_SECONDS ou até o exp do token, o que vier primeiro. Tokens revogados ficam
+    na lista até o próprio exp, quando deixariam de ser aceitos de qualquer forma.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict() # hash do token -> (expira_em, payload)
+        self.revoked = {} # hash do token -> exp (epoch)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'revoked_rejections': 0}
+
+    def get(self, key):
+        """Retorna o payload do token se ele estiver no cache e ainda válido; None caso contrário."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now: # passou do TTL ou do exp do token
+                del self.entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                TOKEN_CACHE_REQUESTS.labels('miss').inc()
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            TOKEN_CACHE_REQUESTS.labels('hit').inc()
+            return entry[1]
+
+    def put(self, key, payload):
+        """Guarda o payload de um token recém-verificado."""
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if payload.get('exp') is not None:
+            expires_at = min(expires_at, payload['exp'])
+        with self.lock:
+            if key in self.revoked:
+                return
+            self.entries[key] = (expires_at, payload)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries: # remove os menos usados
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def is_revoked(self, key):
+        """Indica se o token foi revogado (e ainda não expirou)."""
+        with self.lock:
+            exp = self.revoked.get(key)
+            if exp is None:
+                return False
+            if exp <= time.time(): # já expirou: não precisa mais ficar na lista
+                del self.revoked[key]
+                return False
+            self.stats['revoked_rejections'] += 1
+            TOKEN_CACHE_REQUESTS.labels('revoked').inc()
+            return True
+
+    def revoke(self, key, exp):
+        """Revoga o token: sai do cache e é recusado até o exp."""
+        with self.lock:
+            self.entries.pop(key, None)
+            self.revoked[key] = exp
+            now = time.time()
+            for revoked_key in [k for k, v in self.revoked.items() if v <= now]: # limpa revogações vencidas
+                del self.revoked[revoked_key]
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), revoked=len(self.revoked), max_entries=self.max_entries)
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
 
 
 def generate_token(username): # função que recebe username e retorna um token JWT para o usuário
@@ -35,8 +170,46 @@ def generate_token(username): # função que recebe username e retorna um token
     return token
 
 
+def token_key(token):
+    """Chave do token no cache e na lista de revogação (SHA-256 do token)."""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def store_revocation(key, exp):
+    """Grava a revogação em auth.revoked_tokens, que o backend2-api recarrega periodicamente.
+
+    Sem DATABASE_URL, ou com o banco fora do ar, a revogação vale só no backend1 (o erro é logado).
+    """
+    if not DATABASE_URL:
+        return
+    try:
+        conn = psycopg2.connect(DATABASE_URL, connect_timeout=5)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("CREATE SCHEMA IF NOT EXISTS auth")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS auth.revoked_tokens (
+                        token_hash CHAR(64) PRIMARY KEY,
+                        expires_at TIMESTAMPTZ NOT NULL
+                    )
+                """)
+                cur.execute("""
+                    INSERT INTO auth.revoked_tokens (token_hash, expires_at) VALUES (%s, to_timestamp(%s))
+                    ON CONFLICT (token_hash) DO NOTHING
+                """, (key, exp))
+                cur.execute("DELETE FROM auth.revoked_tokens WHERE expires_at <= now()") # revogações vencidas
+            conn.commit()
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        print(f"⚠️  Erro ao gravar revogação em auth.revoked_tokens (vale só no backend1): {e}")
+
+
 def verify_token(f): # decorator para verificar o token JWT
-    """Decorator para verificar o token JWT"""
+    """Decorator para verificar o token JWT.
+
+    Tokens já verificados vêm do token_cache sem repetir o jwt.decode; tokens revogados são recusados.
+    """
     @wraps(f) # preserva metadados da função original, metadados são informações sobre os dados, não os dados em si
     def decorated(*args, **kwargs): # função decorada que verifica o token JWT
         token = None # define o token como None (localmente)
@@ -53,14 +226,23 @@ def verify_token(f): # decorator para verificar o token JWT
         if not token: # se o token não foi fornecido
             return jsonify({'error': 'Token não fornecido'}), 401
         
-        try:
-            # Decodificar e verificar o token
-            data = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]) # decodifica o token ( de string JWT para dicionário Python) para verificar a validade do token
-            request.current_user = data['username'] # armazena o username do usuário
-        except jwt.ExpiredSignatureError: # se o token expirou
-            return jsonify({'error': 'Token expirado'}), 401
-        except jwt.InvalidTokenError: # se o token é inválido
-            return jsonify({'error': 'Token inválido'}), 401
+        key = token_key(token)
+        if token_cache.is_revoked(key): # token revogado (logout) continua recusado mesmo com assinatura válida
+            return jsonify({'error': 'Token revogado'}), 401
+        
+        data = token_cache.get(key) # token verificado há pouco: não precisa decodificar de novo
+        if data is None:
+            try:
+                # Decodificar e verificar o token
+                data = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]) # decodifica o token ( de string JWT para dicionário Python) para verificar a validade do token
+            except jwt.ExpiredSignatureError: # se o token expirou
+                return jsonify({'error': 'Token expirado'}), 401
+            except jwt.InvalidTokenError: # se o token é inválido
+                return jsonify({'error': 'Token inválido'}), 401
+            token_cache.put(key, data)
+        request.current_user = data['username'] # armazena o username do usuário
+        request.token_key = key
+        request.token_exp = data.get('exp') or time.time() + JWT_EXPIRATION_HOURS * 3600 # sem exp: revogação vale pelo prazo padrão
         
         return f(*args, **kwargs) # se o token for válido, chama a função original (f)
     
@@ -78,7 +260,7 @@ def hello():
 
 @app.route('/health') # rota get para o health check
 def health():
-    return {'status': 'healthy'}, 200
+    return {'status': 'healthy', 'token_cache': token_cache.snapshot()}, 200
 
 
 @app.route('/login', methods=['POST']) # rota post para o login, valida credenciais e gera token JWT se forem válidas
@@ -110,101 +292,565 @@ def login():
         return jsonify({'error': f'Erro ao processar login: {str(e)}'}), 500
 
 
-@app.route('/sync', methods=['POST']) # rota post para disparar o pipeline de ingestão de dados
-@verify_token # sempre que houver uma requisição POST para a rota /sync, essa função será chaamda para verificar o token JWT
-def sync(): # função que dispara o pipeline de ingestão (sincronização)
-    """Endpoint protegido para disparar o pipeline de ingestão"""
+class SyncJobError(Exception):
+    """Erro de um job de sincronização, com o status HTTP equivalente."""
+
+    def __init__(self, message, status_code=500, details=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+def utc_now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def prune_sync_jobs():
+    """Remove jobs finalizados há mais de SYNC_JOB_TTL_SECONDS. Deve ser chamada com sync_jobs_lock."""
+    cutoff = time.monotonic() - SYNC_JOB_TTL_SECONDS
+    for job_id in [job_id for job_id, job in sync_jobs.items() if job['_finished'] and job['_finished'] < cutoff]:
+        del sync_jobs[job_id]
+
+
+def public_job(job):
+    """Cópia do job sem os campos internos (prefixo _), para responder em JSON."""
+    with sync_jobs_lock:
+        return {k: v for k, v in job.items() if not k.startswith('_')}
+
+
+def submit_sync_job(kind, key, target, *args):
+    """Enfileira target(job, *args) no pool de sincronização.
+
+    Se já existe um job com a mesma chave na fila ou rodando, não cria outro: retorna (job existente, True).
+    """
+    with sync_jobs_lock:
+        prune_sync_jobs()
+        existing_id = active_sync_jobs.get(key)
+        if existing_id is not None:
+            job = sync_jobs[existing_id]
+            job['coalesced_requests'] += 1
+            return job, True
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'state': 'queued', # queued -> running -> succeeded | failed
+            'rows_processed': 0,
+            'batches_sent': 0,
+            'inserted': 0,
+            'transform_run_ids': [], # execuções do transformer que agregam os pedidos inseridos pelo job
+            'transform_state': None, # pending -> succeeded | failed (None: nada a agregar)
+            'coalesced_requests': 0,
+            'created_at': utc_now_iso(),
+            'started_at': None,
+            'finished_at': None,
+            'queue_seconds': None,
+            'run_seconds': None,
+            'result': None,
+            'error': None,
+            'status_code': None,
+            '_queued': time.monotonic(),
+            '_started': None,
+            '_finished': None,
+        }
+        sync_jobs[job['id']] = job
+        active_sync_jobs[key] = job['id']
+    sync_executor.submit(run_sync_job, job, key, target, *args)
+    return job, False
+
+
+def run_sync_job(job, key, target, *args):
+    """Executa um job no pool, registrando estado e tempos."""
+    with sync_jobs_lock:
+        job['state'] = 'running'
+        job['started_at'] = utc_now_iso()
+        job['_started'] = time.monotonic()
+        job['queue_seconds'] = round(job['_started'] - job['_queued'], 3)
+    SYNC_JOB_QUEUE_SECONDS.labels(job['kind']).observe(job['_started'] - job['_queued'])
+    try:
+        result = target(job, *args)
+        with sync_jobs_lock:
+            job['result'] = result
+            job['state'] = 'succeeded'
+            job['status_code'] = 200
+    except SyncJobError as e:
+        with sync_jobs_lock:
+            job['state'] = 'failed'
+            job['error'] = str(e)
+            job['result'] = e.details
+            job['status_code'] = e.status_code
+    except Exception as e:
+        with sync_jobs_lock:
+            job['state'] = 'failed'
+            job['error'] = f'Erro ao executar sincronização: {str(e)}'
+            job['status_code'] = 500
+    finally:
+        with sync_jobs_lock:
+            job['_finished'] = time.monotonic()
+            job['finished_at'] = utc_now_iso()
+            job['run_seconds'] = round(job['_finished'] - job['_started'], 3)
+            if active_sync_jobs.get(key) == job['id']:
+                del active_sync_jobs[key]
+        SYNC_JOB_SECONDS.labels(job['kind'], job['state']).observe(job['_finished'] - job['_started'])
+
+
+def accepted_job_response(job, coalesced, message):
+    """Resposta 202 com o id do job e a URL para acompanhar o progresso."""
+    return jsonify({
+        'message': message,
+        'job_id': job['id'],
+        'state': job['state'],
+        'coalesced': coalesced,
+        'status_url': f"/sync/jobs/{job['id']}",
+    }), 202
+
+
+def record_transform_run(job, pipeline_response):
+    """Guarda no job o id da execução do transformer devolvido pelo pipeline (lotes agrupados repetem o id)."""
+    run_id = pipeline_response.get('transform_run_id')
+    with sync_jobs_lock:
+        if run_id and run_id not in job['transform_run_ids']:
+            job['transform_run_ids'].append(run_id)
+            job['transform_state'] = 'pending'
+
+
+def wait_for_transform(job):
+    """Espera as execuções do transformer registradas no job terminarem.
+
+    O pipeline só agenda a transformação; sem esta espera o job terminaria antes de daily_metrics e
+    os rollups refletirem os pedidos, e o dashboard recarregaria métricas antigas.
+    """
+    deadline = time.monotonic() + TRANSFORM_WAIT_SECONDS
+    for run_id in list(job['transform_run_ids']):
+        while True:
+            try:
+                response = requests.get(f"{TRANSFORMER_URL}/runs/{run_id}", timeout=10)
+            except requests.exceptions.RequestException:
+                raise SyncJobError('Não foi possível consultar o transformer', 503)
+            if response.status_code != 200:
+                raise SyncJobError(f'Erro ao consultar a transformação {run_id}: status {response.status_code}', 502, response.text)
+            run = response.json()
+            if run['state'] == 'failed':
+                with sync_jobs_lock:
+                    job['transform_state'] = 'failed'
+                raise SyncJobError(f"Pedidos gravados, mas a transformação falhou: {run['error']}", 502, run)
+            if run['state'] == 'succeeded':
+                break
+            if time.monotonic() >= deadline:
+                raise SyncJobError('Timeout ao aguardar a transformação dos dados', 504, run)
+            time.sleep(TRANSFORM_POLL_SECONDS)
+    if job['transform_run_ids']:
+        with sync_jobs_lock:
+            job['transform_state'] = 'succeeded'
+
+
+def run_pipeline_sync(job):
+    """Job de /sync: dispara a ingestão do data-source no pipeline."""
     try:
         # Fazer chamada HTTP para o pipeline
-        response = requests.post( # faz uma requisição POST para o acessar o endpoint POST /trigger do pipeline para realizar a ingestão de dados
-            PIPELINE_URL,
-            timeout=30  # Timeout de 30 segundos
-        ) # faz uma requisição POST para o pipeline
-        
-        if response.status_code == 200: # se a resposta do pipeline for 200 (sucesso)
-            return jsonify({
-                'message': 'Pipeline de ingestão disparado com sucesso',
-                'pipeline_response': response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
-            }), 200
-        else: # se a resposta do pipeline não for 200 (erro)
-            return jsonify({
-                'error': f'Erro ao disparar pipeline: status {response.status_code}', # retorna o erro
-                'details': response.text # retorna o texto da resposta
-            }), response.status_code # retorna o status code da resposta
-    
+        with PIPELINE_SECONDS.labels('sync').time():
+            response = requests.post( # faz uma requisição POST para o acessar o endpoint POST /trigger do pipeline para realizar a ingestão de dados
+                PIPELINE_URL,
+                timeout=30  # Timeout de 30 segundos
+            ) # faz uma requisição POST para o pipeline
     except requests.exceptions.Timeout: # se o timeout for excedido
-        return jsonify({'error': 'Timeout ao aguardar resposta do pipeline'}), 504
-    
+        raise SyncJobError('Timeout ao aguardar resposta do pipeline', 504)
     except requests.exceptions.ConnectionError: # se não foi possível conectar ao pipeline
-        return jsonify({'error': 'Não foi possível conectar ao pipeline'}), 503
-    
-    except Exception as e: # se houver erro, retorna o erro
-        return jsonify({'error': f'Erro ao disparar pipeline: {str(e)}'}), 500
+        raise SyncJobError('Não foi possível conectar ao pipeline', 503)
 
+    if response.status_code != 200: # se a resposta do pipeline não for 200 (erro)
+        raise SyncJobError(f'Erro ao disparar pipeline: status {response.status_code}', response.status_code, response.text)
 
-def parse_orders_csv(content):
-    """Lê CSV com delimitador ; e colunas order_id, created_at, status, value, payment_method. Retorna lista de dicts no formato do pipeline."""
-    content = content.lstrip('\ufeff')
-    orders = []
-    reader = csv.DictReader(io.StringIO(content), delimiter=';')
+    payload = pipeline_payload(response)
+    if isinstance(payload, dict):
+        with sync_jobs_lock:
+            job['rows_processed'] = payload.get('total', 0)
+            job['inserted'] = payload.get('inserted', 0)
+        record_transform_run(job, payload)
+    wait_for_transform(job)
+    return {
+        'message': 'Pipeline de ingestão disparado com sucesso',
+        'pipeline_response': payload,
+    }
+
+
+@app.route('/logout', methods=['POST']) # rota post para revogar o token usado na requisição
+@verify_token
+def logout():
+    """Endpoint protegido que revoga o token atual: ele sai do cache e passa a ser recusado até expirar."""
+    token_cache.revoke(request.token_key, request.token_exp)
+    store_revocation(request.token_key, request.token_exp)
+    return jsonify({'message': 'Logout realizado com sucesso'}), 200
+
+
+@app.route('/sync', methods=['POST']) # rota post para disparar o pipeline de ingestão de dados
+@verify_token # sempre que houver uma requisição POST para a rota /sync, essa função será chaamda para verificar o token JWT
+def sync(): # função que enfileira a ingestão (sincronização)
+    """Endpoint protegido para disparar o pipeline de ingestão.
+
+    Enfileira um job e responde 202 na hora; o progresso é consultado em GET /sync/jobs/<id>.
+    Chamadas enquanto outra sincronização está na fila ou rodando reaproveitam o mesmo job.
+    """
+    job, coalesced = submit_sync_job('sync', 'sync', run_pipeline_sync)
+    return accepted_job_response(job, coalesced, 'Sincronização enfileirada')
+
+
+@app.route('/sync/jobs/<job_id>', methods=['GET'])
+@verify_token
+def sync_job_status(job_id):
+    """Endpoint protegido que retorna estado, linhas processadas e tempos de um job de sincronização."""
+    with sync_jobs_lock:
+        job = sync_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(public_job(job)), 200
+
+
+def iter_orders_csv(lines):
+    """Lê CSV com delimitador ; e colunas order_id, created_at, status, value, payment_method a partir de um iterável de linhas. Gera um dict por pedido válido no formato do pipeline, sem materializar o arquivo."""
+    reader = csv.DictReader(lines, delimiter=';')
     required = {'order_id', 'created_at', 'status', 'value', 'payment_method'}
     for row in reader:
+        if None in row or None in row.values(): # colunas a mais ou a menos: descartada, como no parser colunar
+            continue
         row = {k.strip(): v for k, v in row.items()}
         if not row or required - set(row.keys()):
             continue
-        try:
-            value = float(str(row['value']).replace(',', '.'))
-        except (ValueError, TypeError):
+        value = parse_value(row['value'])
+        if value is None:
             continue
-        orders.append({
+        yield {
             'order_id': row['order_id'].strip(),
             'created_at': row['created_at'].strip(),
             'status': row['status'].strip(),
             'value': value,
             'payment_method': row['payment_method'].strip(),
-        })
-    return orders
+        }
+
+
+def parse_value(raw):
+    """Converte o value do CSV (vírgula decimal, espaços nas pontas) em float; None se estiver fora do formato VALUE_PATTERN."""
+    value = raw.strip().replace(',', '.')
+    return float(value) if re.fullmatch(VALUE_PATTERN, value) else None
+
+
+def parse_orders_csv(content):
+    """Lê CSV com delimitador ; e colunas order_id, created_at, status, value, payment_method. Retorna lista de dicts no formato do pipeline."""
+    return list(iter_orders_csv(io.StringIO(content.lstrip('\ufeff'))))
+
+
+def use_columnar_parser():
+    """Indica se o upload deve ser lido pelo parser colunar, conforme CSV_ENGINE e a presença do pyarrow."""
+    if CSV_ENGINE == 'python':
+        return False
+    if pa is None:
+        if CSV_ENGINE == 'arrow':
+            raise RuntimeError('CSV_ENGINE=arrow requer o pacote pyarrow')
+        return False
+    return True
+
+
+def iter_order_columns(path):
+    """Lê o CSV salvo em blocos de CSV_BLOCK_SIZE bytes com pyarrow e gera um pa.Table por bloco, só com pedidos válidos.
+
+    Aplica as mesmas regras de iter_orders_csv, mas no bloco inteiro: textos sem espaços nas pontas,
+    value com vírgula decimal convertido para float e linhas com value inválido ou colunas faltando descartadas.
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file: # o cabeçalho é lido como no csv.DictReader
+        header = next(csv.reader(file, delimiter=';'), None)
+    if not header:
+        return
+    header = [name.strip() for name in header]
+    if set(ORDER_COLUMNS) - set(header):
+        return
+
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(column_names=header, skip_rows=1, block_size=CSV_BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(delimiter=';', invalid_row_handler=lambda row: 'skip'), # linhas com colunas a menos ou a mais
+        convert_options=pa_csv.ConvertOptions( # tudo como texto: a conversão de value é feita abaixo
+            column_types={name: pa.string() for name in ORDER_COLUMNS},
+            include_columns=ORDER_COLUMNS,
+        ),
+    )
+    for batch in reader:
+        columns = {name: pc.utf8_trim_whitespace(batch.column(name)) for name in ORDER_COLUMNS}
+        value = pc.replace_substring(columns['value'], ',', '.')
+        valid = pc.fill_null(pc.match_substring_regex(value, f'^{VALUE_PATTERN}$'), False)
+        columns['value'] = pc.cast(pc.if_else(valid, value, None), pa.float64()) # inválidos viram null e são descartados abaixo
+        yield pa.table(columns).filter(valid)
+
+
+def json_string_column(column):
+    """Converte uma coluna de texto em strings JSON entre aspas, de forma vetorizada."""
+    escaped = pc.replace_substring(pc.replace_substring(column, '\\', '\\\\'), '"', '\\"')
+    return pc.binary_join_element_wise('"', escaped, '"', '')
+
+
+def encode_orders_table(table):
+    """Serializa um pa.Table de pedidos como o array JSON esperado pelo pipeline, sem criar um dict por pedido.
+
+    Tabelas com caracteres de controle nos textos (que exigiriam escape \\uXXXX) caem para o json.dumps.
+    """
+    text_columns = [name for name in ORDER_COLUMNS if name != 'value']
+    if any(pc.any(pc.match_substring_regex(table.column(name), '[\\x00-\\x1f]')).as_py() for name in text_columns):
+        return json.dumps(table.to_pylist())
+    objects = pc.binary_join_element_wise(
+        '{"order_id": ', json_string_column(table.column('order_id')),
+        ', "created_at": ', json_string_column(table.column('created_at')),
+        ', "status": ', json_string_column(table.column('status')),
+        ', "value": ', pc.cast(table.column('value'), pa.string()),
+        ', "payment_method": ', json_string_column(table.column('payment_method')),
+        '}',
+        '', # separador entre as partes acima
+    )
+    return '[' + ','.join(objects.to_pylist()) + ']'
+
+
+def little_endian(values):
+    """Retorna os bytes de um array('I'/'d') em little-endian, a ordem do formato binário."""
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def binary_strings(values):
+    """Codifica uma lista de textos como offsets uint32 (n + 1) seguidos dos bytes UTF-8 concatenados."""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = array('I', [0])
+    offsets.extend(accumulate(map(len, encoded)))
+    return [little_endian(offsets), b''.join(encoded)]
+
+
+def binary_dictionary(values):
+    """Codifica uma lista de textos repetitivos como dicionário (quantidade, offsets, bytes) + índices uint32."""
+    dictionary = {}
+    indices = array('I', (dictionary.setdefault(value, len(dictionary)) for value in values))
+    return [struct.pack('<I', len(dictionary))] + binary_strings(list(dictionary)) + [little_endian(indices)]
+
+
+def encode_binary_rows(batch):
+    """Codifica um lote de pedidos no formato binário colunar aceito pelo pipeline (application/x-orders-binary).
+
+    O corpo é BINARY_MAGIC seguido de um bloco: uint32 n; order_id e created_at como texto;
+    status como dicionário; value como float64 n; payment_method como dicionário. Tudo em little-endian.
+    """
+    parts = [BINARY_MAGIC, struct.pack('<I', len(batch))]
+    parts += binary_strings([order['order_id'] for order in batch])
+    parts += binary_strings([order['created_at'] for order in batch])
+    parts += binary_dictionary([order['status'] for order in batch])
+    parts.append(little_endian(array('d', [order['value'] for order in batch])))
+    parts += binary_dictionary([order['payment_method'] for order in batch])
+    return b''.join(parts)
+
+
+def arrow_buffer(values, width):
+    """Retorna os bytes dos valores de um array Arrow de tipo fixo (int32/float64), respeitando o slice."""
+    return values.buffers()[1][values.offset * width:(values.offset + len(values)) * width].to_pybytes()
+
+
+def arrow_binary_strings(column):
+    """Como binary_strings, mas reaproveitando os buffers de uma coluna de texto Arrow."""
+    _, offsets, data = column.buffers()
+    offsets = pa.Array.from_buffers(pa.int32(), len(column) + 1, [None, offsets], offset=column.offset)
+    first, last = offsets[0].as_py(), offsets[-1].as_py()
+    if first: # coluna recortada (slice): offsets passam a começar em zero
+        offsets = pc.subtract(offsets, pa.scalar(first, pa.int32()))
+    return [arrow_buffer(offsets, 4), data[first:last].to_pybytes() if data is not None else b'']
+
+
+def arrow_binary_dictionary(column):
+    """Como binary_dictionary, com o dictionary_encode do Arrow."""
+    encoded = pc.dictionary_encode(column)
+    return [struct.pack('<I', len(encoded.dictionary))] + arrow_binary_strings(encoded.dictionary) + [arrow_buffer(encoded.indices, 4)]
+
+
+def encode_binary_table(table):
+    """Codifica um pa.Table de pedidos no formato binário (mesmo layout de encode_binary_rows)."""
+    if sys.byteorder == 'big': # buffers do Arrow estão na ordem da máquina
+        return encode_binary_rows(table.to_pylist())
+    columns = {name: table.column(name).combine_chunks() for name in ORDER_COLUMNS}
+    parts = [BINARY_MAGIC, struct.pack('<I', table.num_rows)]
+    parts += arrow_binary_strings(columns['order_id'])
+    parts += arrow_binary_strings(columns['created_at'])
+    parts += arrow_binary_dictionary(columns['status'])
+    parts.append(arrow_buffer(columns['value'], 8))
+    parts += arrow_binary_dictionary(columns['payment_method'])
+    return b''.join(parts)
+
+
+def iter_upload_batches(path, size, fmt='json'):
+    """Gera (quantidade de pedidos, corpo) para cada lote de até size pedidos do CSV salvo.
+
+    O corpo é o array JSON ou, com fmt='binary', o formato binário colunar.
+    Usa o parser colunar quando disponível; senão lê linha a linha com iter_orders_csv.
+    """
+    if not use_columnar_parser():
+        encode_rows = encode_binary_rows if fmt == 'binary' else lambda batch: json.dumps(batch).encode('utf-8')
+        with open(path, 'r', encoding='utf-8-sig', newline='') as lines:
+            for batch in iter_batches(iter_orders_csv(lines), size):
+                yield len(batch), encode_rows(batch)
+        return
+
+    encode_table = encode_binary_table if fmt == 'binary' else lambda table: encode_orders_table(table).encode('utf-8')
+
+    try:
+        pending = [] # blocos lidos que ainda não completaram um lote
+        pending_rows = 0
+        for table in iter_order_columns(path):
+            pending.append(table)
+            pending_rows += table.num_rows
+            while pending_rows >= size:
+                table = pa.concat_tables(pending)
+                yield size, encode_table(table.slice(0, size))
+                rest = table.slice(size)
+                pending, pending_rows = [rest], rest.num_rows
+        if pending_rows:
+            yield pending_rows, encode_table(pa.concat_tables(pending))
+    except pa.ArrowInvalid as error:
+        if 'UTF8' in str(error): # mesmo erro que o UnicodeDecodeError do caminho linha a linha
+            raise UnicodeDecodeError('utf-8', b'', 0, 1, str(error))
+        raise
+
+
+def iter_batches(orders, size):
+    """Agrupa um iterável de pedidos em listas de até size pedidos."""
+    batch = []
+    for order in orders:
+        batch.append(order)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def pipeline_payload(response):
+    """Retorna o corpo da resposta do pipeline (JSON se possível, senão texto)."""
+    if response.headers.get('content-type', '').startswith('application/json'):
+        return response.json()
+    return response.text
+
+
+def partial_ingestion_error(job, error):
+    """Erro do upload depois de parte dos lotes já ter sido enviada ao pipeline.
+
+    Os pedidos desses lotes continuam gravados e a agregação deles já foi agendada: espera as execuções
+    do transformer registradas até aqui, para o job refletir o que o dashboard vai mostrar, e devolve o
+    erro com o quanto foi ingerido.
+    """
+    try:
+        wait_for_transform(job)
+        transform_error = None
+    except SyncJobError as e:
+        transform_error = str(e)
+    with sync_jobs_lock:
+        partial = {name: job[name] for name in ('batches_sent', 'rows_processed', 'inserted', 'transform_run_ids', 'transform_state')}
+    partial['transform_error'] = transform_error
+    message = (f"{error} (ingestão parcial: {partial['batches_sent']} lote(s) com {partial['rows_processed']} pedidos "
+               f"já enviados ao pipeline continuam gravados)")
+    return SyncJobError(message, error.status_code, {'error_details': error.details, 'partial_ingestion': partial})
+
+
+def upload_csv_to_pipeline(job, path):
+    """Job de /sync/upload: lê o CSV salvo em blocos e envia ao pipeline em lotes de UPLOAD_BATCH_SIZE pedidos.
+
+    Os lotes são gravados um a um; se algo falhar no meio do arquivo, os já enviados não são desfeitos
+    e o erro do job informa a ingestão parcial (ver partial_ingestion_error).
+    """
+    parse_seconds = 0.0
+    failure = None
+    try:
+        pipeline_response = None
+        batches = iter_upload_batches(path, UPLOAD_BATCH_SIZE, PIPELINE_UPLOAD_FORMAT)
+        while True:
+            started = time.perf_counter()
+            batch = next(batches, None) # leitura, validação e serialização do próximo lote do CSV
+            parse_seconds += time.perf_counter() - started
+            if batch is None:
+                break
+            rows, body = batch
+            try:
+                with PIPELINE_SECONDS.labels('upload_batch').time():
+                    response = requests.post(
+                        PIPELINE_URL,
+                        data=body,
+                        headers={'Content-Type': PIPELINE_CONTENT_TYPES[PIPELINE_UPLOAD_FORMAT]},
+                        timeout=60,
+                    )
+            except requests.exceptions.Timeout:
+                raise SyncJobError('Timeout ao aguardar resposta do pipeline', 504)
+            except requests.exceptions.ConnectionError:
+                raise SyncJobError('Não foi possível conectar ao pipeline', 503)
+            if response.status_code != 200:
+                raise SyncJobError(f'Erro no pipeline: status {response.status_code}', response.status_code, response.text)
+            pipeline_response = pipeline_payload(response)
+            with sync_jobs_lock:
+                job['rows_processed'] += rows
+                job['batches_sent'] += 1
+                if isinstance(pipeline_response, dict):
+                    job['inserted'] += pipeline_response.get('inserted', 0)
+            if isinstance(pipeline_response, dict):
+                record_transform_run(job, pipeline_response)
+    except UnicodeDecodeError:
+        failure = SyncJobError('Arquivo deve ser UTF-8', 400)
+    except SyncJobError as e:
+        failure = e
+    except Exception as e: # ex.: erro do leitor CSV no meio do arquivo
+        failure = SyncJobError(f'Erro ao executar sincronização: {str(e)}')
+    finally:
+        os.remove(path)
+        CSV_PARSE_SECONDS.observe(parse_seconds)
+        CSV_ROWS.inc(job['rows_processed'])
+        if job['rows_processed'] and parse_seconds > 0:
+            CSV_PARSE_ROWS_PER_SECOND.set(job['rows_processed'] / parse_seconds)
+    if failure is not None:
+        if job['batches_sent']: # parte do arquivo já foi gravada
+            raise partial_ingestion_error(job, failure)
+        raise failure
+    if not job['batches_sent']:
+        raise SyncJobError('CSV inválido ou vazio. Use colunas: order_id;created_at;status;value;payment_method (delimitador ;)', 400)
+    wait_for_transform(job)
+    return {
+        'message': 'Pipeline executado com sucesso com seu arquivo CSV',
+        'pipeline_response': pipeline_response,
+    }
 
 
 @app.route('/sync/upload', methods=['POST'])
 @verify_token
 def sync_upload():
-    """Endpoint protegido para enviar um CSV e disparar o pipeline com esses dados."""
+    """Endpoint protegido para enviar um CSV e disparar o pipeline com esses dados.
+
+    O arquivo é copiado em blocos para um arquivo temporário e processado por um job em segundo plano,
+    que valida as linhas conforme lê e as envia ao pipeline em lotes de UPLOAD_BATCH_SIZE pedidos.
+    Responde 202 com o id do job; o envio do mesmo arquivo enquanto ele é processado reaproveita o job.
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'Nenhum arquivo enviado. Use o campo "file" com um CSV.'}), 400
         f = request.files['file']
         if not f.filename or not f.filename.lower().endswith('.csv'):
             return jsonify({'error': 'Envie um arquivo .csv'}), 400
-        content = f.read().decode('utf-8')
-        orders = parse_orders_csv(content)
-        if not orders:
-            return jsonify({'error': 'CSV inválido ou vazio. Use colunas: order_id;created_at;status;value;payment_method (delimitador ;)'}), 400
-        response = requests.post(
-            PIPELINE_URL,
-            json=orders,
-            headers={'Content-Type': 'application/json'},
-            timeout=60,
-        )
-        if response.status_code == 200:
-            return jsonify({
-                'message': 'Pipeline executado com sucesso com seu arquivo CSV',
-                'pipeline_response': response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text,
-            }), 200
-        return jsonify({
-            'error': f'Erro no pipeline: status {response.status_code}',
-            'details': response.text,
-        }), response.status_code
-    except requests.exceptions.Timeout:
-        return jsonify({'error': 'Timeout ao aguardar resposta do pipeline'}), 504
-    except requests.exceptions.ConnectionError:
-        return jsonify({'error': 'Não foi possível conectar ao pipeline'}), 503
-    except UnicodeDecodeError:
-        return jsonify({'error': 'Arquivo deve ser UTF-8'}), 400
+        # O upload precisa sobreviver à requisição; o hash do conteúdo identifica envios repetidos
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(prefix='upload-', suffix='.csv', delete=False) as tmp:
+            for chunk in iter(lambda: f.stream.read(1024 * 1024), b''):
+                digest.update(chunk)
+                tmp.write(chunk)
+        job, coalesced = submit_sync_job('upload', f'upload:{digest.hexdigest()}', upload_csv_to_pipeline, tmp.name)
+        if coalesced: # mesmo arquivo já está sendo processado
+            os.remove(tmp.name)
+        return accepted_job_response(job, coalesced, 'Arquivo recebido, processamento enfileirado')
     except Exception as e:
         return jsonify({'error': f'Erro ao processar CSV: {str(e)}'}), 500
 
 
+@app.route('/metrics') # métricas no formato Prometheus
+def metrics():
+    """Métricas no formato Prometheus (latência do pipeline, parse de CSV, jobs de sincronização e cache de tokens)"""
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
 # Executa o serviço na porta 5000 se o arquivo for executado diretamente
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
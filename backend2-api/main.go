@@ -1,13 +1,17 @@
 package main
 
 import (
+	"crypto/sha256"
 	"database/sql"
+	"encoding/hex"
 	"encoding/json"
 	"fmt"
 	"log"
 	"net/http"
 	"os"
+	"strconv"
 	"strings"
+	"sync"
 	"time"
 
 	"github.com/golang-jwt/jwt/v5"
@@ -26,6 +30,14 @@ type Filters struct {
 	StartDate     string `json:"start_date,omitempty"`
 	EndDate       string `json:"end_date,omitempty"`
 	PaymentMethod string `json:"payment_method,omitempty"`
+	Granularity   string `json:"granularity,omitempty"`
+}
+
+// timeSeriesSources mapeia a granularidade da série temporal para a tabela agregada e a coluna do período
+var timeSeriesSources = map[string][2]string{
+	"day":   {"aggregated.daily_metrics", "date"},
+	"week":  {"aggregated.weekly_metrics", "week_start"},
+	"month": {"aggregated.monthly_metrics", "month"},
 }
 
 type FinancialMetrics struct {
@@ -57,6 +69,13 @@ type TimeSeriesPoint struct { // estrutura para um ponto (dia) da série tempora
 
 var jwtSecret string // variável global para a chave JWT
 
+// Revogação (logout): o backend1-auth grava o SHA-256 dos tokens revogados em auth.revoked_tokens.
+// Uma goroutine recarrega a lista a cada revocationRefresh; a checagem por requisição é só uma consulta
+// ao mapa em memória. Um logout passa a valer aqui em no máximo revocationRefresh
+var revocationRefresh = 5 * time.Second // intervalo entre recargas de auth.revoked_tokens
+var revokedTokens = map[string]bool{}   // SHA-256 do token -> revogado
+var revokedTokensMu sync.RWMutex
+
 func main() {
 	// Obter JWT_SECRET da variável de ambiente (deve ser a mesma do backend1-auth)
 	jwtSecret = os.Getenv("JWT_SECRET") // pega a chave JWT da variável de ambiente (configuração do sistema, não do código)
@@ -65,6 +84,11 @@ func main() {
 		log.Println("⚠️  JWT_SECRET não configurada, usando valor padrão")
 	}
 
+	if seconds, err := strconv.Atoi(os.Getenv("REVOCATION_REFRESH_SECONDS")); err == nil && seconds > 0 {
+		revocationRefresh = time.Duration(seconds) * time.Second
+	}
+	go refreshRevokedTokens() // mantém revokedTokens atualizado em segundo plano
+
 	// Configurar rotas para expor endpoints
 	http.HandleFunc("/", corsMiddleware(helloHandler)) // todas são protegidas pelo CORS
 	http.HandleFunc("/health", corsMiddleware(healthHandler))
@@ -131,11 +155,76 @@ func verifyTokenMiddleware(next http.HandlerFunc) http.HandlerFunc {
 			return
 		}
 
+		// Assinatura válida; falta conferir se o token foi revogado (logout) no backend1
+		if isTokenRevoked(tokenString) {
+			http.Error(w, `{"error": "Token revogado"}`, http.StatusUnauthorized)
+			return
+		}
+
 		// Token válido, continuar com a requisição
 		next(w, r)
 	}
 }
 
+// isTokenRevoked indica se o token está na última lista carregada de auth.revoked_tokens
+func isTokenRevoked(tokenString string) bool {
+	sum := sha256.Sum256([]byte(tokenString))
+	key := hex.EncodeToString(sum[:]) // mesma chave do TokenCache do backend1; o token em si não fica em memória
+	revokedTokensMu.RLock()
+	defer revokedTokensMu.RUnlock()
+	return revokedTokens[key]
+}
+
+// refreshRevokedTokens recarrega auth.revoked_tokens a cada revocationRefresh. Se o banco falhar, mantém a
+// última lista carregada (as requisições continuam validadas pela assinatura do JWT) e loga o erro
+func refreshRevokedTokens() {
+	var db *sql.DB
+	for {
+		if db == nil {
+			var err error
+			if db, err = getDB(); err != nil {
+				log.Printf("⚠️  Erro ao conectar para carregar tokens revogados: %v", err)
+				db = nil
+			}
+		}
+		if db != nil {
+			if revoked, err := loadRevokedTokens(db); err != nil {
+				log.Printf("⚠️  Erro ao carregar tokens revogados, mantendo a lista anterior: %v", err)
+			} else {
+				revokedTokensMu.Lock()
+				revokedTokens = revoked
+				revokedTokensMu.Unlock()
+			}
+		}
+		time.Sleep(revocationRefresh)
+	}
+}
+
+// loadRevokedTokens lê as revogações ainda não expiradas (tabela ausente: nenhum logout ainda)
+func loadRevokedTokens(db *sql.DB) (map[string]bool, error) {
+	revoked := map[string]bool{}
+	var table sql.NullString
+	if err := db.QueryRow("SELECT to_regclass('auth.revoked_tokens')::text").Scan(&table); err != nil {
+		return nil, err
+	}
+	if !table.Valid {
+		return revoked, nil
+	}
+	rows, err := db.Query("SELECT token_hash FROM auth.revoked_tokens WHERE expires_at > now()")
+	if err != nil {
+		return nil, err
+	}
+	defer rows.Close()
+	for rows.Next() {
+		var key string
+		if err := rows.Scan(&key); err != nil {
+			return nil, err
+		}
+		revoked[key] = true
+	}
+	return revoked, rows.Err()
+}
+
 func helloHandler(w http.ResponseWriter, r *http.Request) { // define o handler para a rota raiz, endpoint retorna informações básicas do serviço
 	response := map[string]string{ // cria mapa (dicionário) para a resposta
 		"service": "backend2-api",
@@ -199,40 +288,13 @@ func metricsHandler(w http.ResponseWriter, r *http.Request) { // define o handle
 	}
 	defer db.Close()
 
-	// Construir query base. query é uma instrução enviada ao banco de dados.
-	query := `
-		SELECT 
-			status,
-			SUM(total_orders) as total_orders, -- soma o total de pedidos
-			SUM(total_value) as total_value -- soma o total de valor
-		FROM aggregated.daily_metrics
-		WHERE 1=1
-	`
-
-	args := []interface{}{} // slice vazio (pois não há argumentos na query base, então não sabemos quais filtros serão usados) para argumentos da query
-	argIndex := 1
-
-	// Adicionar filtros
-	if startDate != "" { // se startDate não estiver vazio
-		query += fmt.Sprintf(" AND date >= $%d", argIndex) // adiciona o filtro de data inicial à query
-		args = append(args, startDate)                     // adiciona o valor de startDate ao slice de argumentos
-		argIndex++
-	}
-
-	if endDate != "" {
-		query += fmt.Sprintf(" AND date <= $%d", argIndex) // adiciona o filtro de data final à query
-		args = append(args, endDate)                       // adiciona o valor de endDate ao slice de argumentos
-		argIndex++
-	}
-
-	if paymentMethod != "" {
-		query += fmt.Sprintf(" AND payment_method = $%d", argIndex) // adiciona o filtro de método de pagamento à query
-		args = append(args, paymentMethod)                          // adiciona o valor de paymentMethod ao slice de argumentos
-		argIndex++
+	// Construir query usando os rollups do transformer (meses completos e total geral)
+	query, args, err := buildMetricsQuery(startDate, endDate, paymentMethod)
+	if err != nil {
+		http.Error(w, err.Error(), http.StatusBadRequest)
+		return
 	}
 
-	query += " GROUP BY status" // agrupa os resultados por status
-
 	// Executar query
 	rows, err := db.Query(query, args...) // executa a query
 	if err != nil {
@@ -280,6 +342,77 @@ func metricsHandler(w http.ResponseWriter, r *http.Request) { // define o handle
 	json.NewEncoder(w).Encode(metrics)                 // codifica as métricas em json e escreve na resposta, que é enviada para o frontend
 }
 
+// buildMetricsQuery monta a query de totais por status para o período pedido.
+// Sem datas usa aggregated.total_metrics; com datas soma aggregated.monthly_metrics para os meses
+// completos dentro do período e aggregated.daily_metrics só para os dias avulsos das bordas.
+func buildMetricsQuery(startDate, endDate, paymentMethod string) (string, []interface{}, error) {
+	args := []interface{}{}
+	addArg := func(value interface{}) string { // adiciona o argumento e retorna o placeholder ($1, $2, ...)
+		args = append(args, value)
+		return fmt.Sprintf("$%d", len(args))
+	}
+	paymentFilter := func() string {
+		if paymentMethod == "" {
+			return ""
+		}
+		return " AND payment_method = " + addArg(paymentMethod)
+	}
+
+	if startDate == "" && endDate == "" {
+		query := "SELECT status, SUM(total_orders), SUM(total_value) FROM aggregated.total_metrics WHERE 1=1" + paymentFilter() + " GROUP BY status"
+		return query, args, nil
+	}
+
+	// Meses completos do período: [monthFrom, monthTo); nil = sem limite daquele lado
+	var start, end time.Time
+	var monthFrom, monthTo *time.Time
+	if startDate != "" {
+		parsed, err := time.Parse("2006-01-02", startDate)
+		if err != nil {
+			return "", nil, fmt.Errorf("start_date inválida: %s", startDate)
+		}
+		start = parsed
+		month := time.Date(start.Year(), start.Month(), 1, 0, 0, 0, 0, time.UTC)
+		if !month.Equal(start) { // começa no meio do mês: o primeiro mês completo é o seguinte
+			month = month.AddDate(0, 1, 0)
+		}
+		monthFrom = &month
+	}
+	if endDate != "" {
+		parsed, err := time.Parse("2006-01-02", endDate)
+		if err != nil {
+			return "", nil, fmt.Errorf("end_date inválida: %s", endDate)
+		}
+		end = parsed
+		nextDay := end.AddDate(0, 0, 1) // end é inclusivo; se for o último dia do mês, o mês entra completo
+		month := time.Date(nextDay.Year(), nextDay.Month(), 1, 0, 0, 0, 0, time.UTC)
+		monthTo = &month
+	}
+
+	var parts []string
+	if monthFrom != nil && monthTo != nil && !monthFrom.Before(*monthTo) { // nenhum mês completo: só dias
+		parts = append(parts, "SELECT status, total_orders, total_value FROM aggregated.daily_metrics WHERE date >= "+addArg(startDate)+" AND date <= "+addArg(endDate)+paymentFilter())
+	} else {
+		monthly := "SELECT status, total_orders, total_value FROM aggregated.monthly_metrics WHERE 1=1"
+		if monthFrom != nil {
+			monthly += " AND month >= " + addArg(monthFrom.Format("2006-01-02"))
+		}
+		if monthTo != nil {
+			monthly += " AND month < " + addArg(monthTo.Format("2006-01-02"))
+		}
+		parts = append(parts, monthly+paymentFilter())
+		if monthFrom != nil && start.Before(*monthFrom) { // dias antes do primeiro mês completo
+			parts = append(parts, "SELECT status, total_orders, total_value FROM aggregated.daily_metrics WHERE date >= "+addArg(startDate)+" AND date < "+addArg(monthFrom.Format("2006-01-02"))+paymentFilter())
+		}
+		if monthTo != nil && !end.Before(*monthTo) { // dias depois do último mês completo
+			parts = append(parts, "SELECT status, total_orders, total_value FROM aggregated.daily_metrics WHERE date >= "+addArg(monthTo.Format("2006-01-02"))+" AND date <= "+addArg(endDate)+paymentFilter())
+		}
+	}
+
+	query := "SELECT status, SUM(total_orders), SUM(total_value) FROM (" + strings.Join(parts, " UNION ALL ") + ") AS periods GROUP BY status"
+	return query, args, nil
+}
+
 // timeSeriesHandler retorna séries temporais para gráficos
 func timeSeriesHandler(w http.ResponseWriter, r *http.Request) { // função que define o handler para a rota /api/metrics/time-series, endpoint retorna séries temporais para gráficos
 	if r.Method != http.MethodGet {
@@ -291,6 +424,16 @@ func timeSeriesHandler(w http.ResponseWriter, r *http.Request) { // função que
 	startDate := r.URL.Query().Get("start_date") // pega o valor do parâmetro start_date
 	endDate := r.URL.Query().Get("end_date")
 	paymentMethod := r.URL.Query().Get("payment_method")
+	granularity := r.URL.Query().Get("granularity") // day (padrão), week ou month
+	if granularity == "" {
+		granularity = "day"
+	}
+	source, ok := timeSeriesSources[granularity] // rollup semanal/mensal mantido pelo transformer
+	if !ok {
+		http.Error(w, "granularity deve ser day, week ou month", http.StatusBadRequest)
+		return
+	}
+	table, periodColumn := source[0], source[1]
 
 	// Conectar ao banco
 	db, err := getDB()
@@ -301,32 +444,33 @@ func timeSeriesHandler(w http.ResponseWriter, r *http.Request) { // função que
 	defer db.Close()
 
 	// Construir query para séries temporais
-	query := `
+	// Com granularity=week/month cada ponto é o início do período; períodos parcialmente no filtro entram inteiros
+	query := fmt.Sprintf(`
 		SELECT 
-			date,
+			%[1]s,
 			SUM(CASE WHEN status = 'approved' THEN total_value ELSE 0 END) as approved_revenue, -- soma o total de valor para os pedidos aprovados, se não for aprovado é 0
 			SUM(CASE WHEN status = 'pending' THEN total_value ELSE 0 END) as pending_revenue,
 			SUM(CASE WHEN status = 'cancelled' THEN total_value ELSE 0 END) as cancelled_revenue,
 			SUM(CASE WHEN status = 'approved' THEN total_orders ELSE 0 END) as approved_orders,
 			SUM(CASE WHEN status = 'pending' THEN total_orders ELSE 0 END) as pending_orders,
 			SUM(CASE WHEN status = 'cancelled' THEN total_orders ELSE 0 END) as cancelled_orders
-		FROM aggregated.daily_metrics
+		FROM %[2]s
 		WHERE 1=1
-	`
+	`, periodColumn, table)
 
 	args := []interface{}{} // slice vazio para argumentos da query
 	argIndex := 1
 
 	// Adicionar filtros
 	if startDate != "" { // se startDate não estiver vazio
-		query += fmt.Sprintf(" AND date >= $%d", argIndex) // adiciona o filtro de data inicial à query
-		args = append(args, startDate)                     // adiciona o valor de startDate ao slice de argumentos
+		query += fmt.Sprintf(" AND %s >= DATE_TRUNC('%s', $%d::date)", periodColumn, granularity, argIndex) // adiciona o filtro de data inicial à query (início do período que contém a data)
+		args = append(args, startDate)                                                                      // adiciona o valor de startDate ao slice de argumentos
 		argIndex++
 	}
 
 	if endDate != "" {
-		query += fmt.Sprintf(" AND date <= $%d", argIndex) // adiciona o filtro de data final à query
-		args = append(args, endDate)                       // adiciona o valor de endDate ao slice de argumentos
+		query += fmt.Sprintf(" AND %s <= $%d", periodColumn, argIndex) // adiciona o filtro de data final à query
+		args = append(args, endDate)                                   // adiciona o valor de endDate ao slice de argumentos
 		argIndex++
 	}
 
@@ -336,7 +480,7 @@ func timeSeriesHandler(w http.ResponseWriter, r *http.Request) { // função que
 		argIndex++
 	}
 
-	query += " GROUP BY date ORDER BY date" // agrupa os resultados por data e ordena por data
+	query += fmt.Sprintf(" GROUP BY %[1]s ORDER BY %[1]s", periodColumn) // agrupa os resultados por período e ordena por período
 
 	// Executar query
 	rows, err := db.Query(query, args...) // executa a query com os argumentos
@@ -376,6 +520,7 @@ func timeSeriesHandler(w http.ResponseWriter, r *http.Request) { // função que
 			StartDate:     startDate,     // data inicial
 			EndDate:       endDate,       // data final
 			PaymentMethod: paymentMethod, // método de pagamento
+			Granularity:   granularity,   // dia, semana ou mês
 		},
 		Data: timeSeries, // pontos da série temporal
 	}
@@ -0,0 +1,82 @@
+"""Gera arquivos orders.csv sintéticos no mesmo formato do CSV real (delimitador ; e vírgula decimal).
+
+Uso:
+    python benchmarks/generate_orders.py 1m --output /tmp/orders_1m.csv
+    python benchmarks/generate_orders.py 250000 --days 90 --seed 7
+
+Tamanhos prontos: 10k, 1m e 10m (ou qualquer número de linhas).
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta, timezone
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Distribuição conjunta de status e payment_method observada no orders.csv de exemplo
+STATUS_PAYMENT_WEIGHTS = [
+    (('approved', 'pix'), 57),
+    (('approved', 'credit_card'), 53),
+    (('cancelled', 'credit_card'), 44),
+    (('pending', 'boleto'), 22),
+    (('approved', 'boleto'), 22),
+    (('pending', 'credit_card'), 13),
+    (('pending', 'pix'), 9),
+]
+CENTS = ['90', '00', '50', '99'] # finais de preço mais comuns
+CHUNK_ROWS = 100_000 # linhas geradas e gravadas por vez
+
+
+def parse_size(value):
+    """Converte '10k', '1m', '10m' ou um número em quantidade de linhas"""
+    value = value.lower()
+    if value in SIZES:
+        return SIZES[value]
+    return int(value.replace('_', ''))
+
+
+def generate_orders(rows, output, days=365, start=date(2025, 1, 1), seed=42):
+    """Grava rows pedidos em output, distribuídos em ordem cronológica por days dias a partir de start"""
+    rng = random.Random(seed) # mesma semente, mesmo arquivo: resultados comparáveis entre versões
+    combos = [combo for combo, _ in STATUS_PAYMENT_WEIGHTS]
+    weights = [weight for _, weight in STATUS_PAYMENT_WEIGHTS]
+    start_at = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+    seconds_per_row = days * 86400 / rows
+
+    with open(output, 'w', encoding='utf-8', newline='') as file:
+        file.write('order_id;created_at;status;value;payment_method\n')
+        sequence = 0 # sequência do pedido dentro do dia, como em 20260120-001
+        current_day = None
+        for chunk_start in range(0, rows, CHUNK_ROWS):
+            size = min(CHUNK_ROWS, rows - chunk_start)
+            chosen = rng.choices(combos, weights, k=size)
+            lines = []
+            for offset, (status, payment_method) in enumerate(chosen):
+                created_at = start_at + timedelta(seconds=int((chunk_start + offset) * seconds_per_row))
+                if created_at.date() != current_day:
+                    current_day = created_at.date()
+                    sequence = 0
+                sequence += 1
+                reais = int(rng.lognormvariate(4.8, 0.7)) + 1 # mediana perto de R$ 120, cauda longa
+                lines.append(
+                    f"{created_at:%Y%m%d}-{sequence:06d};{created_at:%Y-%m-%dT%H:%M:%SZ};"
+                    f"{status};{reais},{rng.choice(CENTS)};{payment_method}\n"
+                )
+            file.writelines(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera orders.csv sintético (delimitador ; e vírgula decimal)')
+    parser.add_argument('size', help="quantidade de linhas: 10k, 1m, 10m ou um número")
+    parser.add_argument('--output', help='arquivo de saída (padrão: orders_<size>.csv)')
+    parser.add_argument('--days', type=int, default=365, help='dias cobertos pelos pedidos (padrão: 365)')
+    parser.add_argument('--seed', type=int, default=42, help='semente do gerador aleatório (padrão: 42)')
+    args = parser.parse_args()
+
+    rows = parse_size(args.size)
+    output = args.output or f'orders_{args.size.lower()}.csv'
+    generate_orders(rows, output, days=args.days, seed=args.seed)
+    print(f"✅ {rows} pedidos gravados em {output}")
+
+
+if __name__ == '__main__':
+    main()
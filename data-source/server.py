@@ -1,49 +1,941 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
+from itertools import accumulate, chain, islice
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 import csv
+import hashlib
+import heapq
+import json
+import mmap
 import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from functools import partial
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+except ImportError: # o parser colunar é opcional; sem pyarrow o CSV é lido com csv.DictReader
+    pa = None
 
 app = Flask(__name__) # Inicializa o Flask
 
 CSV_FILE = '/app/orders.csv' # Caminho do arquivo CSV
+STREAM_BATCH_ROWS = int(os.getenv('STREAM_BATCH_ROWS', '1000')) # pedidos serializados por chunk da resposta
+CSV_ENGINE = os.getenv('CSV_ENGINE', 'auto') # auto (pyarrow se instalado), arrow ou python
+CSV_BLOCK_SIZE = int(os.getenv('CSV_BLOCK_SIZE', str(4 * 1024 * 1024))) # bytes lidos por bloco no parser colunar
+ORDER_COLUMNS = ['order_id', 'created_at', 'status', 'value', 'payment_method']
+VALUE_PATTERN = r'[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?' # value aceito, depois de trocar a vírgula decimal por ponto (os dois parsers usam a mesma regra)
+BINARY_MIMETYPE = 'application/x-orders-binary' # formato binário colunar (ver encode_binary_rows)
+BINARY_MAGIC = b'ORDB\x01' # início de toda resposta binária: assinatura + versão do formato
+MIMETYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson', 'binary': BINARY_MIMETYPE}
+INDEX_FILE = os.getenv('INDEX_FILE') # índice do CSV (offsets por linha, created_at e order_id); padrão: <CSV_FILE>.idx
+INDEX_CHUNK_ROWS = int(os.getenv('INDEX_CHUNK_ROWS', '100000')) # pedidos ordenados em memória por vez ao montar o índice
+INDEX_MERGE_BLOCK = 65536 # valores lidos e gravados por vez ao intercalar os trechos do índice
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024))) # teto de memória do cache de respostas (0 desativa)
+
+# Métricas Prometheus expostas em /metrics
+PARSE_SECONDS = Histogram('data_source_csv_parse_seconds', 'Tempo lendo e convertendo o CSV por resposta', ['format'])
+SERIALIZE_SECONDS = Histogram('data_source_serialize_seconds', 'Tempo serializando pedidos por resposta', ['format'])
+ROWS_SERVED = Counter('data_source_rows_served_total', 'Pedidos lidos do CSV e serializados', ['format'])
+PARSE_ROWS_PER_SECOND = Gauge('data_source_parse_rows_per_second', 'Vazão de leitura do CSV na última resposta gerada', ['format'])
+CACHE_REQUESTS = Counter('data_source_cache_requests_total', 'Consultas ao cache de respostas', ['result'])
+
+class PayloadCache: # cache LRU em memória das respostas já serializadas
+    """Guarda respostas serializadas por variante (formato, offset, limit), validadas pela assinatura do arquivo.
+
+    A assinatura é (inode, mtime, tamanho): se o CSV for trocado ou alterado, a entrada é descartada.
+    Quando o total passa de max_bytes, as entradas menos usadas são removidas.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # variante -> (assinatura, payload)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'bypassed': 0}
+
+    def get(self, variant, signature):
+        with self.lock:
+            entry = self.entries.get(variant)
+            if entry is not None and entry[0] != signature: # arquivo mudou desde que a entrada foi gravada
+                self._remove(variant)
+                self.stats['invalidations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                CACHE_REQUESTS.labels('miss').inc()
+                return None
+            self.entries.move_to_end(variant)
+            self.stats['hits'] += 1
+            CACHE_REQUESTS.labels('hit').inc()
+            return entry[1]
+
+    def put(self, variant, signature, payload):
+        with self.lock:
+            if len(payload) > self.max_bytes: # maior que o cache inteiro: não vale guardar
+                self.stats['bypassed'] += 1
+                return
+            if variant in self.entries:
+                self._remove(variant)
+            self.entries[variant] = (signature, payload)
+            self.size += len(payload)
+            while self.size > self.max_bytes: # remove as menos usadas até caber no teto
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def record_bypass(self):
+        with self.lock:
+            self.stats['bypassed'] += 1
+
+    def _remove(self, variant):
+        _, payload = self.entries.pop(variant)
+        self.size -= len(payload)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes)
+
+payload_cache = PayloadCache(CACHE_MAX_BYTES)
+
+def parse_timestamp(value): # converte created_at ISO 8601 (com ou sem "Z") em datetime com fuso
+    """Converte um created_at ISO 8601 em datetime com fuso; horários sem fuso são tratados como UTC"""
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def complete_size(path, size): # posição logo após a última linha completa do arquivo
+    """Retorna o byte logo após a última linha completa em [0, size).
+
+    Uma linha final sem \\n conta como completa se tiver todas as colunas do cabeçalho (arquivos que
+    terminam sem quebra de linha, como o orders.csv de exemplo); com colunas faltando ela pode estar
+    sendo escrita e fica para a próxima leitura.
+    """
+    with open(path, 'rb') as file:
+        header = file.readline()
+        if not header.endswith(b'\n'): # só o cabeçalho (ou nem ele): nenhum pedido
+            return 0
+        boundary, end = len(header), size
+        while end > len(header):
+            start = max(len(header), end - 65536)
+            file.seek(start)
+            block = file.read(end - start)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                boundary = start + newline + 1
+                break
+            end = start
+        if boundary < size:
+            file.seek(boundary)
+            try:
+                tail = split_line(file.read(size - boundary))
+            except UnicodeDecodeError: # caractere multibyte cortado no meio: ainda sendo escrita
+                return boundary
+            if len(tail) == len(split_line(header.rstrip(b'\n'))):
+                return size
+        return boundary
+
+def iter_lines(file, end): # gera as linhas do arquivo binário decodificadas, parando no byte end
+    """Gera as linhas (decodificadas) de file a partir da posição atual até o byte end (None = até o fim)"""
+    position = file.tell()
+    for line in file:
+        if end is not None and position >= end:
+            break
+        position += len(line)
+        yield line.decode('utf-8')
+
+def use_columnar_parser(): # decide entre o parser colunar (pyarrow) e o csv.DictReader
+    """Indica se o parser colunar deve ser usado, conforme CSV_ENGINE e a presença do pyarrow"""
+    if CSV_ENGINE == 'python':
+        return False
+    if pa is None:
+        if CSV_ENGINE == 'arrow':
+            raise RuntimeError('CSV_ENGINE=arrow requer o pacote pyarrow')
+        return False
+    return True
+
+def parse_timestamps(created_at): # converte uma coluna inteira de created_at ISO 8601 para timestamp UTC
+    """Converte a coluna created_at para timestamp UTC de uma vez; valores fora do formato viram null"""
+    with_zone = pc.strptime(created_at, format='%Y-%m-%dT%H:%M:%S%z', unit='us', error_is_null=True)
+    without_zone = pc.assume_timezone( # horários sem fuso são tratados como UTC, como em parse_timestamp
+        pc.strptime(created_at, format='%Y-%m-%dT%H:%M:%S', unit='us', error_is_null=True), 'UTC')
+    return pc.coalesce(with_zone, without_zone)
+
+def iter_order_columns(path=None, end_offset=None): # Gerador que lê o CSV em blocos e devolve colunas em vez de dicionários
+    """Lê o CSV em blocos de CSV_BLOCK_SIZE bytes com pyarrow e gera um dict de colunas (arrays Arrow) por bloco.
+
+    value já vem como float64 (vírgula decimal convertida no bloco inteiro); as demais colunas mantêm o texto original.
+    end_offset: lê só os bytes [0, end_offset), deixando de fora uma linha final ainda sendo escrita.
+    """
+    path = path or CSV_FILE
+    if not os.path.exists(path) or os.path.getsize(path) == 0 or end_offset == 0:
+        return
+
+    with pa.OSFile(path) as source:
+        reader = pa_csv.open_csv(
+            source if end_offset is None else source.get_stream(0, end_offset),
+            read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+            parse_options=pa_csv.ParseOptions(delimiter=';', invalid_row_handler=lambda row: 'skip'), # linhas com colunas a menos ou a mais
+            convert_options=pa_csv.ConvertOptions( # tudo como texto: a conversão de value é feita abaixo
+                column_types={name: pa.string() for name in ORDER_COLUMNS},
+                include_columns=ORDER_COLUMNS,
+            ),
+        )
+        for batch in reader:
+            value = pc.replace_substring(pc.utf8_trim_whitespace(batch.column('value')), ',', '.') # Converte vírgula para ponto
+            valid = pc.fill_null(pc.match_substring_regex(value, f'^{VALUE_PATTERN}$'), False)
+            columns = {name: batch.column(name) for name in ORDER_COLUMNS}
+            columns['value'] = pc.cast(pc.if_else(valid, value, None), pa.float64()) # inválidos viram null e são descartados abaixo
+            if not pc.all(valid).as_py(): # linhas com value inválido ficam de fora, como em order_from_row
+                columns = {name: pc.filter(column, valid) for name, column in columns.items()}
+            yield columns
+
+def iter_orders(path=None, since=None, start_offset=None, end_offset=None): # Gerador que lê o CSV sob demanda, um pedido por vez
+    """Lê o arquivo CSV linha a linha e gera cada pedido como dicionário, sem carregar o arquivo inteiro.
+
+    since: só gera pedidos com created_at posterior a esse datetime.
+    start_offset/end_offset: lê apenas as linhas entre esses bytes (CSV append-only), sem varrer o início do arquivo.
+    """
+    path = path or CSV_FILE
+    if not os.path.exists(path): # se o arquivo não existe, não gera nada
+        return
+
+    with open(path, 'rb') as file:
+        header = next(csv.reader([file.readline().decode('utf-8')], delimiter=';'), None) # cabeçalho sempre vem do início do arquivo
+        if not header:
+            return
+        if start_offset: # pula direto para o último ponto já lido
+            file.seek(start_offset)
+        reader = csv.DictReader(iter_lines(file, end_offset), fieldnames=header, delimiter=';')
 
-def read_orders(): # Função que lê o arquivo CSV e retorna os dados como lista de dicionários
-    """Lê o arquivo CSV e retorna os dados como lista de dicionários"""
-    orders = []
-    
-    if not os.path.exists(CSV_FILE): # se o arquivo não existe, retorna uma lista vazia
-        return orders
-    
-    with open(CSV_FILE, 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file, delimiter=';')
-        
         for row in reader: # para cada linha do arquivo CSV, cria um dicionário com os dados da linha
-            # Normaliza os dados conforme necessário
-            order = {
-                'order_id': row['order_id'],
-                'created_at': row['created_at'],
-                'status': row['status'],
-                'value': float(row['value'].replace(',', '.')),  # Converte vírgula para ponto
-                'payment_method': row['payment_method']
-            }
-            orders.append(order)
-    
-    return orders
-
-@app.route('/') # Endpoint GET que retorna todos os pedidos do CSV
-def get_orders(): # Função que retorna todos os pedidos do CSV
-    """Endpoint GET que retorna todos os pedidos do CSV"""
+            order = order_from_row(row)
+            if order is None: # linha malformada: ignorada
+                continue
+            if since is not None and parse_timestamp(order['created_at']) <= since:
+                continue
+            yield order
+
+def parse_value(raw): # value do CSV (vírgula decimal, espaços nas pontas) como float
+    """Converte o value do CSV em float; None se estiver ausente ou fora do formato VALUE_PATTERN"""
+    value = (raw or '').strip().replace(',', '.') # Converte vírgula para ponto
+    return float(value) if re.fullmatch(VALUE_PATTERN, value) else None
+
+def order_from_row(row): # Normaliza uma linha do CSV (dict por coluna) no formato de pedido da API
+    """Monta o pedido a partir da linha lida do CSV.
+
+    Retorna None para linhas com colunas a menos ou a mais, ou com value inválido: elas são ignoradas
+    (como no parser colunar) em vez de derrubar a resposta no meio do streaming.
+    """
+    if None in row or None in row.values():
+        return None
+    value = parse_value(row['value'])
+    if value is None:
+        return None
+    return {
+        'order_id': row['order_id'],
+        'created_at': row['created_at'],
+        'status': row['status'],
+        'value': value,
+        'payment_method': row['payment_method']
+    }
+
+def read_orders(since=None, start_offset=None): # Função que lê o arquivo CSV e retorna os dados como lista de dicionários
+    """Lê o arquivo CSV e retorna os dados como lista de dicionários (opcionalmente só os novos, ver iter_orders)"""
+    return list(iter_orders(since=since, start_offset=start_offset))
+
+def timestamp_key(value): # created_at como inteiro (microssegundos desde 1970, UTC), a chave do índice por data
+    """Converte um datetime com fuso em microssegundos desde a época"""
+    return int(value.replace(microsecond=0).timestamp()) * 1000000 + value.microsecond
+
+def timestamp_keys(values): # chaves de uma lista de created_at de uma vez; None para datas inválidas
+    """Converte created_at em chaves do índice, em bloco com pyarrow quando disponível"""
+    keys = pc.cast(parse_timestamps(pa.array(values, pa.string())), pa.int64()).to_pylist() if use_columnar_parser() else [None] * len(values)
+    for position, key in enumerate(keys):
+        if key is None: # formatos que o strptime não cobre (ex.: frações de segundo) ou parser colunar desligado
+            try:
+                keys[position] = timestamp_key(parse_timestamp(values[position]))
+            except ValueError: # created_at inválido: pedido fica fora do índice por data
+                pass
+    return keys
+
+def split_line(line): # separa os campos de uma linha do CSV (bytes, sem o \n)
+    """Retorna os campos da linha; só usa o módulo csv quando há aspas"""
+    text = line.decode('utf-8').rstrip('\r')
+    if '"' not in text:
+        return text.split(';')
+    return next(csv.reader([text], delimiter=';'), [])
+
+class OrdersIndex: # índice do CSV gravado ao lado do arquivo e lido via mmap
+    """Índice do CSV para buscas sem varrer o arquivo.
+
+    Guarda, para o arquivo com a assinatura (inode, mtime, tamanho) indicada no cabeçalho:
+    o byte de início de cada pedido na ordem do arquivo, as chaves created_at ordenadas com
+    os respectivos bytes de início e os bytes de início ordenados por order_id. Os arrays são
+    lidos direto do mmap do arquivo de índice; a busca é binária sobre eles.
+    """
+
+    MAGIC = b'ORDX\x02\x00\x00\x00' # versão 2: só linhas com todas as colunas e value válido
+    HEADER = struct.Struct('=8s7Q') # assinatura, inode, mtime_ns, tamanho, fim indexado, pedidos, com data válida, com order_id
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        magic, ino, mtime_ns, size, self.end, self.rows, timed, identified = self.HEADER.unpack_from(buffer)
+        if magic != self.MAGIC:
+            raise ValueError('arquivo de índice inválido')
+        self.signature = (ino, mtime_ns, size)
+        view = memoryview(buffer)[self.HEADER.size:]
+        sections = [('row_offsets', 'Q', self.rows), ('time_keys', 'q', timed),
+                    ('time_offsets', 'Q', timed), ('id_offsets', 'Q', identified)]
+        for name, kind, count in sections:
+            if len(view) < count * 8:
+                raise ValueError('arquivo de índice truncado')
+            setattr(self, name, view[:count * 8].cast(kind))
+            view = view[count * 8:]
+        self.header = None # cabeçalho do CSV, lido no primeiro acesso ao arquivo
+
+    @classmethod
+    def build(cls, path, stat, end, output, previous=None): # varre o CSV e grava o índice em output
+        """Grava em output (arquivo aberto em modo binário) o índice das linhas completas do CSV até end.
+
+        A varredura ordena trechos de até INDEX_CHUNK_ROWS pedidos e os guarda em arquivos temporários;
+        no fim os trechos são intercalados direto no arquivo de saída, sem manter o CSV inteiro em memória.
+        previous: índice do mesmo arquivo antes de crescer (ver extended_by); só as linhas depois do fim
+        dele são lidas e os arrays dele entram na intercalação como mais um trecho.
+        """
+        fd = output.fileno()
+        with open(path, 'rb') as file, tempfile.TemporaryFile() as rows_spill, tempfile.TemporaryFile() as runs_spill:
+            header_line = file.readline()
+            header = split_line(header_line.rstrip(b'\n'))
+            if not {'order_id', 'created_at', 'value'} <= set(header): # arquivo vazio ou cabeçalho incompleto (sendo reescrito): índice vazio
+                header, previous, end = [], None, 0
+            id_column, created_column, value_column = (header.index(name) if header else None for name in ('order_id', 'created_at', 'value'))
+            id_at = lambda offset: split_line(line_at(file.fileno(), offset))[id_column] # pread: não mapeia nem mexe na posição de file
+            time_runs, id_runs = [], [] # trechos ordenados: (função que gera os blocos de colunas, primeiro item, último item, tamanho)
+            if previous is not None and previous.time_keys:
+                time_runs.append((partial(memory_blocks, previous.time_keys, previous.time_offsets), (previous.time_keys[0], previous.time_offsets[0]),
+                                  (previous.time_keys[-1], previous.time_offsets[-1]), len(previous.time_keys)))
+            if previous is not None and previous.id_offsets:
+                id_runs.append((partial(memory_blocks, previous.id_offsets), id_at(previous.id_offsets[0]), id_at(previous.id_offsets[-1]), len(previous.id_offsets)))
+
+            row_offsets = array('Q') # bytes de início das linhas servidas (todas as colunas e value válido)
+            created = [] # created_at dessas linhas, convertidos em chaves a cada trecho
+            ids = [] # (order_id, byte de início)
+            def flush(): # ordena o trecho atual e o grava nos arquivos temporários
+                rows_spill.write(row_offsets.tobytes())
+                timed = sorted((key, offset) for key, offset in zip(timestamp_keys(created), row_offsets) if key is not None)
+                if timed:
+                    keys_at = spill_array(runs_spill, array('q', (key for key, _ in timed)))
+                    offsets_at = spill_array(runs_spill, array('Q', (offset for _, offset in timed)))
+                    time_runs.append((partial(spilled_blocks, runs_spill, len(timed), (keys_at, 'q'), (offsets_at, 'Q')), timed[0], timed[-1], len(timed)))
+                ids.sort()
+                if ids:
+                    offsets_at = spill_array(runs_spill, array('Q', (offset for _, offset in ids)))
+                    id_runs.append((partial(spilled_blocks, runs_spill, len(ids), (offsets_at, 'Q')), ids[0][0], ids[-1][0], len(ids)))
+                del row_offsets[:]
+                created.clear()
+                ids.clear()
+
+            position = previous.end if previous is not None else len(header_line)
+            file.seek(position)
+            if previous is not None and b'\n' not in os.pread(file.fileno(), 2, position - 1):
+                position += len(file.readline()) # o índice anterior incluía a linha final sem \n, que continuou sendo escrita
+            for line in file:
+                if position >= end: # linha final ainda sendo escrita
+                    break
+                fields = split_line(line.rstrip(b'\n'))
+                if len(fields) == len(header) and parse_value(fields[value_column]) is not None: # só as linhas que a leitura completa serve
+                    row_offsets.append(position)
+                    ids.append((fields[id_column], position))
+                    created.append(fields[created_column])
+                    if len(row_offsets) >= INDEX_CHUNK_ROWS:
+                        flush()
+                position += len(line)
+            flush()
+
+            previous_rows = previous.rows if previous is not None else 0
+            rows = previous_rows + rows_spill.tell() // 8
+            timed = sum(run[3] for run in time_runs)
+            identified = sum(run[3] for run in id_runs)
+            os.pwrite(fd, cls.HEADER.pack(cls.MAGIC, stat.st_ino, stat.st_mtime_ns, stat.st_size, end, rows, timed, identified), 0)
+            position = cls.HEADER.size
+            new_rows = spilled_blocks(rows_spill, rows - previous_rows, (0, 'Q'))
+            for block in chain(memory_blocks(previous.row_offsets) if previous_rows else (), new_rows): # os do índice anterior e os novos, na ordem do arquivo
+                position += os.pwrite(fd, block[0].tobytes(), position)
+            write_runs(fd, time_runs, [(position, 'q'), (position + timed * 8, 'Q')])
+            position += timed * 16
+            write_runs(fd, id_runs, [(position, 'Q')], key=lambda item: id_at(item[0]))
+
+    def extended_by(self, stat, end): # o CSV atual é o deste índice com linhas acrescentadas no fim?
+        """Indica se o CSV com esse stat é o mesmo arquivo (inode) deste índice, só que maior (CSV append-only)"""
+        ino, _, size = self.signature
+        if ino != stat.st_ino or size > stat.st_size or self.end > end or self.end == 0: # índice vazio: não há o que reaproveitar
+            return False
+        if self.end == size: # índice anterior ia até o fim do arquivo (ver complete_size)
+            return True
+        with open(CSV_FILE, 'rb') as file: # o fim indexado continua sendo um início de linha
+            file.seek(self.end - 1)
+            return file.read(1) == b'\n'
+
+    def time_range(self, start=None, end=None): # bytes de início dos pedidos com start <= created_at < end
+        """Retorna os bytes de início dos pedidos no intervalo [start, end), em ordem de created_at"""
+        first = 0 if start is None else bisect_left(self.time_keys, timestamp_key(start))
+        last = len(self.time_keys) if end is None else bisect_left(self.time_keys, timestamp_key(end))
+        return self.time_offsets[first:max(first, last)]
+
+    def lookup(self, data, order_id): # bytes de início dos pedidos com esse order_id
+        """Retorna os bytes de início das linhas com o order_id, por busca binária lendo o CSV mapeado em data"""
+        key = lambda offset: self.read_row(data, offset)['order_id']
+        first = bisect_left(self.id_offsets, order_id, key=key)
+        last = bisect_right(self.id_offsets, order_id, lo=first, key=key)
+        return sorted(self.id_offsets[first:last]) # na ordem do arquivo
+
+    def read_row(self, data, offset): # lê a linha que começa em offset no CSV mapeado
+        """Retorna a linha do CSV que começa no byte offset como dict por coluna"""
+        if self.header is None:
+            self.header = split_line(data[:data.find(b'\n')])
+        return dict(zip(self.header, split_line(data[offset:line_end(data, offset)])))
+
+def line_end(data, offset): # fim da linha que começa em offset no CSV mapeado
+    """Retorna a posição do \\n que termina a linha, ou o fim do arquivo para a linha final sem \\n"""
+    newline = data.find(b'\n', offset)
+    return len(data) if newline == -1 else newline
+
+def line_at(fd, offset): # lê a linha que começa em offset sem mapear o CSV
+    """Retorna a linha (bytes, sem o \\n) que começa no byte offset do arquivo aberto em fd"""
+    line = b''
+    while True:
+        chunk = os.pread(fd, 512, offset + len(line))
+        newline = chunk.find(b'\n')
+        if newline != -1:
+            return line + chunk[:newline]
+        line += chunk
+        if not chunk:
+            return line
+
+def spill_array(file, values): # grava um array no fim de um arquivo temporário
+    """Grava o array em file e retorna a posição onde ele começa"""
+    position = file.seek(0, os.SEEK_END)
+    file.write(values.tobytes())
+    return position
+
+def spilled_blocks(file, count, *columns, size=INDEX_MERGE_BLOCK): # lê de volta, em blocos, arrays gravados por spill_array
+    """Gera tuplas com um bloco de até size valores de cada array; columns = [(posição em file, tipo do array), ...], count valores cada"""
+    file.flush()
+    for start in range(0, count, size):
+        length = min(size, count - start)
+        block = []
+        for position, kind in columns:
+            values = array(kind)
+            values.frombytes(os.pread(file.fileno(), length * 8, position + start * 8))
+            block.append(values)
+        yield tuple(block)
+
+def memory_blocks(*views, size=INDEX_MERGE_BLOCK): # os arrays (memoryviews) de um índice já mapeado, em blocos
+    """Gera tuplas com um bloco de até size valores de cada memoryview"""
+    for start in range(0, len(views[0]), size):
+        yield tuple(view[start:start + size] for view in views)
+
+def write_runs(fd, runs, columns, key=None): # intercala trechos ordenados e grava o resultado no arquivo do índice
+    """Grava os itens dos trechos (função que gera os blocos, primeiro item, último item, tamanho) em ordem,
+    a coluna i de cada item no array i; columns = [(posição no arquivo, tipo do array), ...].
+
+    Trechos que já vêm em sequência (CSV em ordem de data e de order_id, o caso comum) são copiados bloco
+    a bloco; senão os itens são intercalados um a um com heapq.merge, lendo blocos menores de cada trecho
+    para a memória total continuar em torno de INDEX_MERGE_BLOCK valores.
+    """
+    positions = [position for position, _ in columns]
+    if all(previous[2] <= current[1] for previous, current in zip(runs, runs[1:])):
+        blocks = chain.from_iterable(run[0]() for run in runs)
+    else:
+        size = max(256, INDEX_MERGE_BLOCK // len(runs))
+        items = heapq.merge(*(chain.from_iterable(zip(*block) for block in run[0](size=size)) for run in runs), key=key)
+        blocks = item_blocks(items, [kind for _, kind in columns])
+    for block in blocks:
+        for column, values in enumerate(block):
+            positions[column] += os.pwrite(fd, values.tobytes(), positions[column])
+
+def item_blocks(items, kinds): # agrupa tuplas em blocos de arrays, um por coluna
+    """Gera tuplas com um array por coluna a cada INDEX_MERGE_BLOCK itens"""
+    while True:
+        block = tuple(array(kind) for kind in kinds)
+        for item in islice(items, INDEX_MERGE_BLOCK):
+            for values, value in zip(block, item):
+                values.append(value)
+        if not block[0]:
+            return
+        yield block
+
+orders_index = None # índice carregado para o arquivo atual
+orders_index_lock = threading.Lock()
+
+def index_path(): # onde o índice do CSV é gravado
+    """Retorna o caminho do arquivo de índice (INDEX_FILE ou <CSV_FILE>.idx)"""
+    return INDEX_FILE or CSV_FILE + '.idx'
+
+def map_index(path): # mapeia um arquivo de índice
+    """Retorna o OrdersIndex mapeado do arquivo em path, ou None se ele não existir ou for inválido"""
+    try:
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return OrdersIndex(buffer)
+    except (OSError, ValueError, struct.error):
+        return None
+
+def load_index_file(path, signature): # abre o índice gravado se ele for do arquivo atual
+    """Retorna o OrdersIndex mapeado do arquivo em path, ou None se não existir ou for de outra versão do CSV"""
+    index = map_index(path)
+    if index is None or index.signature != signature:
+        return None
+    return index
+
+def write_index(path, stat, end, previous): # monta o índice num arquivo novo e o mapeia
+    """Grava o índice em path (troca atômica) e o mapeia.
+
+    Sem permissão de escrita ao lado do CSV, monta num arquivo temporário já removido, que continua
+    acessível só pelo mmap deste processo.
+    """
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as output:
+            OrdersIndex.build(CSV_FILE, stat, end, output, previous)
+        os.replace(temporary, path) # troca atômica: leitores nunca veem um índice pela metade
+        index = map_index(path)
+        if index is not None:
+            return index
+    except OSError as e:
+        app.logger.warning('Não foi possível gravar o índice em %s: %s', path, e)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    with tempfile.TemporaryFile() as output:
+        OrdersIndex.build(CSV_FILE, stat, end, output, previous)
+        return OrdersIndex(mmap.mmap(output.fileno(), 0, access=mmap.ACCESS_READ))
+
+def get_orders_index(stat, end): # índice do CSV atual, carregado do disco, estendido ou reconstruído
+    """Retorna o OrdersIndex do CSV com o stat indicado.
+
+    Usa o índice em memória ou o gravado em disco se a assinatura (inode, mtime, tamanho) bater.
+    Se o CSV só cresceu desde o último índice (mesmo inode, maior), lê só as linhas novas e
+    intercala com ele; senão varre o CSV inteiro. O índice novo é gravado ao lado do CSV.
+    """
+    global orders_index
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with orders_index_lock:
+        if orders_index is not None and orders_index.signature == signature:
+            return orders_index
+        path = index_path()
+        index = load_index_file(path, signature)
+        if index is None:
+            previous = orders_index or map_index(path)
+            if previous is not None and not previous.extended_by(stat, end):
+                previous = None
+            index = write_index(path, stat, end, previous)
+        orders_index = index
+        return index
+
+def in_time_range(order, start, end): # created_at do pedido dentro de [start, end)
+    """Indica se o created_at do pedido está no intervalo [start, end) (limites None são abertos)"""
+    try:
+        created_at = parse_timestamp(order['created_at'])
+    except ValueError:
+        return False
+    return (start is None or created_at >= start) and (end is None or created_at < end)
+
+def iter_indexed_orders(index, offsets): # pedidos cujas linhas começam nos bytes indicados
+    """Gera os pedidos lendo só as linhas indicadas, via mmap do CSV"""
+    if not len(offsets): # nada a ler (o CSV pode ter 0 bytes, que não dá para mapear)
+        return
+    with open(CSV_FILE, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for offset in offsets:
+            order = order_from_row(index.read_row(data, offset))
+            if order is not None:
+                yield order
+
+def lookup_order_offsets(index, order_id): # bytes de início das linhas com o order_id
+    """Busca o order_id no índice, mapeando o CSV só durante a busca"""
+    if not len(index.id_offsets): # índice vazio (o CSV pode ter 0 bytes, que não dá para mapear)
+        return []
+    with open(CSV_FILE, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return index.lookup(data, order_id)
+
+def serialize_batches(orders, encode_batch, fmt): # lê pedidos em lotes e serializa cada lote, medindo as duas etapas
+    """Gera encode_batch(lote) para lotes de STREAM_BATCH_ROWS pedidos e registra tempos de parse e serialização"""
+    parse_seconds = 0.0
+    serialize_seconds = 0.0
+    rows = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            batch = list(islice(orders, STREAM_BATCH_ROWS)) # o parse do CSV acontece aqui (gerador preguiçoso)
+            parsed = time.perf_counter()
+            parse_seconds += parsed - started
+            if not batch:
+                break
+            chunk = encode_batch(batch)
+            serialize_seconds += time.perf_counter() - parsed
+            rows += len(batch)
+            yield chunk
+    finally:
+        PARSE_SECONDS.labels(fmt).observe(parse_seconds)
+        SERIALIZE_SECONDS.labels(fmt).observe(serialize_seconds)
+        ROWS_SERVED.labels(fmt).inc(rows)
+        if rows and parse_seconds > 0:
+            PARSE_ROWS_PER_SECOND.labels(fmt).set(rows / parse_seconds)
+
+def json_string_column(column): # monta a coluna como strings JSON ("..."), escapando aspas e barras
+    """Converte uma coluna de texto em strings JSON entre aspas, vetorizado"""
+    escaped = pc.replace_substring(pc.replace_substring(column, '\\', '\\\\'), '"', '\\"')
+    return pc.binary_join_element_wise('"', escaped, '"', '')
+
+def encode_columns(columns, separator): # serializa um bloco de colunas sem criar um dict por pedido
+    """Monta um objeto JSON por pedido com funções vetorizadas do Arrow e junta os objetos com separator.
+
+    Blocos com caracteres de controle nos textos (que exigiriam escape \\uXXXX) caem para o json.dumps.
+    """
+    text_columns = [name for name in ORDER_COLUMNS if name != 'value']
+    if any(pc.any(pc.match_substring_regex(columns[name], '[\\x00-\\x1f]')).as_py() for name in text_columns):
+        rows = pa.table({name: columns[name] for name in ORDER_COLUMNS}).to_pylist()
+        return separator.join(json.dumps(order) for order in rows)
+    objects = pc.binary_join_element_wise(
+        '{"order_id": ', json_string_column(columns['order_id']),
+        ', "created_at": ', json_string_column(columns['created_at']),
+        ', "status": ', json_string_column(columns['status']),
+        ', "value": ', pc.cast(columns['value'], pa.string()),
+        ', "payment_method": ', json_string_column(columns['payment_method']),
+        '}',
+        '', # separador entre as partes acima
+    )
+    return separator.join(objects.to_pylist())
+
+def little_endian(values): # bytes de um array('I'/'d') em little-endian, a ordem do formato binário
+    """Retorna os bytes do array em little-endian"""
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+def binary_strings(values): # coluna de texto: offsets uint32 (n + 1) seguidos dos bytes UTF-8 concatenados
+    """Codifica uma lista de textos como offsets + bytes"""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = array('I', [0])
+    offsets.extend(accumulate(map(len, encoded)))
+    return [little_endian(offsets), b''.join(encoded)]
+
+def binary_dictionary(values): # coluna repetitiva: dicionário de textos distintos + índice uint32 por pedido
+    """Codifica uma lista de textos como dicionário (quantidade, offsets, bytes) + índices"""
+    dictionary = {}
+    indices = array('I', (dictionary.setdefault(value, len(dictionary)) for value in values))
+    return [struct.pack('<I', len(dictionary))] + binary_strings(list(dictionary)) + [little_endian(indices)]
+
+def encode_binary_rows(batch): # serializa um lote de pedidos (dicts) como um bloco do formato binário
+    """Codifica um lote de pedidos como um bloco do formato binário colunar (application/x-orders-binary).
+
+    Cada bloco é: uint32 n; order_id e created_at como texto (offsets uint32 n + 1, bytes);
+    status como dicionário (uint32 k, offsets k + 1, bytes, índices uint32 n); value como float64 n;
+    payment_method como dicionário. Tudo em little-endian. A resposta é BINARY_MAGIC seguido dos blocos.
+    """
+    parts = [struct.pack('<I', len(batch))]
+    parts += binary_strings([order['order_id'] for order in batch])
+    parts += binary_strings([order['created_at'] for order in batch])
+    parts += binary_dictionary([order['status'] for order in batch])
+    parts.append(little_endian(array('d', [order['value'] for order in batch])))
+    parts += binary_dictionary([order['payment_method'] for order in batch])
+    return b''.join(parts)
+
+def arrow_buffer(values, width): # bytes do buffer de dados de um array Arrow de largura fixa, respeitando o slice
+    """Retorna os bytes dos valores de um array Arrow de tipo fixo (int32/float64)"""
+    return values.buffers()[1][values.offset * width:(values.offset + len(values)) * width].to_pybytes()
+
+def arrow_binary_strings(column): # como binary_strings, mas reaproveitando os buffers do Arrow
+    """Codifica uma coluna de texto Arrow como offsets + bytes, sem passar por objetos Python"""
+    _, offsets, data = column.buffers()
+    offsets = pa.Array.from_buffers(pa.int32(), len(column) + 1, [None, offsets], offset=column.offset)
+    first, last = offsets[0].as_py(), offsets[-1].as_py()
+    if first: # coluna recortada (slice): offsets passam a começar em zero
+        offsets = pc.subtract(offsets, pa.scalar(first, pa.int32()))
+    return [arrow_buffer(offsets, 4), data[first:last].to_pybytes() if data is not None else b'']
+
+def arrow_binary_dictionary(column): # como binary_dictionary, com o dictionary_encode do Arrow
+    """Codifica uma coluna de texto Arrow como dicionário + índices"""
+    encoded = pc.dictionary_encode(column)
+    return [struct.pack('<I', len(encoded.dictionary))] + arrow_binary_strings(encoded.dictionary) + [arrow_buffer(encoded.indices, 4)]
+
+def encode_binary_columns(columns): # serializa um bloco de colunas Arrow no formato binário
+    """Codifica um bloco de colunas como um bloco do formato binário (mesmo layout de encode_binary_rows)"""
+    if sys.byteorder == 'big': # buffers do Arrow estão na ordem da máquina
+        return encode_binary_rows(pa.table({name: columns[name] for name in ORDER_COLUMNS}).to_pylist())
+    parts = [struct.pack('<I', len(columns['order_id']))]
+    parts += arrow_binary_strings(columns['order_id'])
+    parts += arrow_binary_strings(columns['created_at'])
+    parts += arrow_binary_dictionary(columns['status'])
+    parts.append(arrow_buffer(columns['value'], 8))
+    parts += arrow_binary_dictionary(columns['payment_method'])
+    return b''.join(parts)
+
+def slice_column_blocks(blocks, offset, limit): # aplica offset/limit sobre blocos de colunas
+    """Gera os blocos de colunas recortados para pular offset pedidos e parar após limit pedidos"""
+    for columns in blocks:
+        size = len(columns['order_id'])
+        if offset >= size: # bloco inteiro antes do offset
+            offset -= size
+            continue
+        length = size - offset if limit is None else min(size - offset, limit)
+        if offset or length < size:
+            columns = {name: column.slice(offset, length) for name, column in columns.items()}
+        offset = 0
+        yield columns
+        if limit is not None:
+            limit -= length
+            if limit <= 0:
+                return
+
+def serialize_column_blocks(blocks, encode_block, fmt): # como serialize_batches, mas com blocos de colunas
+    """Gera encode_block(colunas) para cada bloco de colunas e registra tempos de parse e serialização"""
+    parse_seconds = 0.0
+    serialize_seconds = 0.0
+    rows = 0
     try:
-        orders = read_orders() # chama a função read_orders para ler o arquivo CSV
-        return jsonify(orders), 200 # retorna os dados como JSON
+        while True:
+            started = time.perf_counter()
+            columns = next(blocks, None) # o parse colunar do próximo bloco acontece aqui
+            parsed = time.perf_counter()
+            parse_seconds += parsed - started
+            if columns is None:
+                break
+            if not len(columns['order_id']):
+                continue
+            chunk = encode_block(columns)
+            serialize_seconds += time.perf_counter() - parsed
+            rows += len(columns['order_id'])
+            yield chunk
+    finally:
+        PARSE_SECONDS.labels(fmt).observe(parse_seconds)
+        SERIALIZE_SECONDS.labels(fmt).observe(serialize_seconds)
+        ROWS_SERVED.labels(fmt).inc(rows)
+        if rows and parse_seconds > 0:
+            PARSE_ROWS_PER_SECOND.labels(fmt).set(rows / parse_seconds)
+
+def stream_columnar(offset, limit, fmt, end): # resposta completa a partir do parser colunar
+    """Gera o array JSON (ou NDJSON, ou o formato binário) do arquivo até o byte end lendo e serializando por blocos de colunas"""
+    blocks = slice_column_blocks(iter_order_columns(end_offset=end), offset, limit)
+    if fmt == 'binary':
+        yield BINARY_MAGIC
+        yield from serialize_column_blocks(blocks, encode_binary_columns, fmt)
+        return
+    if fmt == 'ndjson':
+        for chunk in serialize_column_blocks(blocks, lambda columns: encode_columns(columns, '\n'), fmt):
+            yield chunk + '\n'
+        return
+    yield '['
+    first = True
+    for chunk in serialize_column_blocks(blocks, lambda columns: encode_columns(columns, ','), fmt):
+        yield chunk if first else ',' + chunk
+        first = False
+    yield ']'
+
+def stream_json_array(orders): # serializa um iterável de pedidos como um array JSON, em chunks
+    """Gera o array JSON em pedaços de STREAM_BATCH_ROWS pedidos"""
+    yield '['
+    first = True
+    for chunk in serialize_batches(orders, lambda batch: ','.join(json.dumps(order) for order in batch), 'json'):
+        yield chunk if first else ',' + chunk
+        first = False
+    yield ']'
+
+def stream_ndjson(orders): # serializa um iterável de pedidos como NDJSON (um objeto JSON por linha), em chunks
+    """Gera NDJSON em pedaços de STREAM_BATCH_ROWS pedidos"""
+    yield from serialize_batches(orders, lambda batch: ''.join(json.dumps(order) + '\n' for order in batch), 'ndjson')
+
+def stream_binary(orders): # serializa um iterável de pedidos no formato binário colunar, em blocos
+    """Gera BINARY_MAGIC e um bloco binário por lote de STREAM_BATCH_ROWS pedidos"""
+    yield BINARY_MAGIC
+    yield from serialize_batches(orders, encode_binary_rows, 'binary')
+
+def cache_payload(chunks, variant, signature): # repassa os chunks e grava a resposta completa no cache ao final
+    """Repassa os chunks da resposta e, se couberem no teto do cache, guarda o payload ao terminar"""
+    collected = []
+    collected_bytes = 0
+    for chunk in chunks:
+        data = chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+        if collected is not None:
+            collected.append(data)
+            collected_bytes += len(data)
+            if collected_bytes > payload_cache.max_bytes: # não vai caber: para de acumular e só transmite
+                collected = None
+        yield data
+    if collected is not None:
+        payload_cache.put(variant, signature, b''.join(collected))
+    else:
+        payload_cache.record_bypass()
+
+def parse_non_negative_int(name): # lê um parâmetro inteiro >= 0 da query string
+    """Retorna o parâmetro da query como inteiro não negativo, None se ausente; ValueError se inválido"""
+    raw = request.args.get(name)
+    if raw is None or raw == '':
+        return None
+    value = int(raw)
+    if value < 0:
+        raise ValueError(name)
+    return value
+
+def parse_cursor(raw, stat, end): # valida o cursor "<inode>:<byte>" devolvido em X-Next-Cursor
+    """Retorna o byte de início indicado pelo cursor; ValueError se o cursor não vale para o arquivo atual"""
+    inode, _, offset = raw.rpartition(':')
+    offset = int(offset)
+    if inode and int(inode) != stat.st_ino: # arquivo foi substituído
+        raise ValueError('arquivo substituído')
+    if offset < 0 or offset > end: # arquivo foi truncado ou reescrito
+        raise ValueError('offset fora do arquivo')
+    if 0 < offset < end:
+        with open(CSV_FILE, 'rb') as file:
+            file.seek(offset - 1)
+            around = file.read(2)
+        # só aceita início de linha, ou o fim de uma linha final sem \n que depois foi terminada (a próxima linha lida vem vazia)
+        if b'\n' not in around:
+            raise ValueError('offset não está no início de uma linha')
+    return offset
+
+def response_format(): # formato escolhido via ?format= ou header Accept
+    """Retorna 'json' (padrão), 'ndjson' ou 'binary', conforme ?format= ou a negociação pelo header Accept"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt if fmt in MIMETYPES else 'json'
+    best = request.accept_mimetypes.best_match(list(MIMETYPES.values()), default='application/json')
+    return next(name for name, mimetype in MIMETYPES.items() if mimetype == best)
+
+def file_etag(stat, *variant): # ETag derivado de mtime e tamanho do arquivo + parâmetros da resposta
+    """Monta o ETag da resposta a partir de mtime/tamanho do CSV e da variante pedida (formato, offset, limit)"""
+    variant_hash = hashlib.md5(repr(variant).encode('utf-8')).hexdigest()[:8]
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}-{variant_hash}'
+
+@app.route('/') # Endpoint GET que retorna os pedidos do CSV
+def get_orders(): # Função que retorna os pedidos do CSV
+    """Endpoint GET que retorna os pedidos do CSV em streaming.
+
+    Parâmetros opcionais: ?offset=&limit= para paginar e ?format=ndjson (ou Accept: application/x-ndjson)
+    para NDJSON; ?format=binary (ou Accept: application/x-orders-binary) para o formato binário colunar.
+    Responde 304 quando o If-None-Match bate com o ETag (mtime + tamanho do arquivo).
+    Consultas pelo índice do CSV (sem varrer o arquivo): ?start=&end= retorna os pedidos com
+    start <= created_at < end, em ordem de created_at, e ?order_id= os pedidos com esse id.
+    Exportação incremental: ?cursor=<valor de X-Next-Cursor> retorna só as linhas adicionadas depois
+    daquele ponto (lendo a partir do byte salvo) e ?since=<created_at> só pedidos mais novos que a data.
+    Toda resposta traz X-Next-Cursor apontando para o fim da última linha completa do arquivo.
+    """
+    try:
+        try:
+            offset = parse_non_negative_int('offset') or 0
+            limit = parse_non_negative_int('limit')
+        except ValueError:
+            return jsonify({'error': 'offset e limit devem ser inteiros não negativos'}), 400
+        fmt = response_format()
+        mimetype = MIMETYPES[fmt]
+
+        if not os.path.exists(CSV_FILE): # sem arquivo, responde vazio (sem ETag)
+            empty = {'json': '[]', 'ndjson': '', 'binary': BINARY_MAGIC}[fmt]
+            response = Response(empty, mimetype=mimetype)
+            response.vary.add('Accept')
+            return response, 200
+
+        stat = os.stat(CSV_FILE)
+        end = complete_size(CSV_FILE, stat.st_size)
+        next_cursor = f'{stat.st_ino}:{end}'
+        try:
+            since = parse_timestamp(request.args['since']) if request.args.get('since') else None
+        except ValueError:
+            return jsonify({'error': 'since deve ser uma data ISO 8601'}), 400
+        try:
+            start_offset = parse_cursor(request.args['cursor'], stat, end) if request.args.get('cursor') else None
+        except ValueError as e:
+            # cursor não vale mais (arquivo trocado/truncado): o cliente deve refazer a leitura completa
+            return jsonify({'error': f'cursor inválido: {e}', 'next_cursor': None}), 409
+        delta = since is not None or start_offset is not None
+        try:
+            range_start = parse_timestamp(request.args['start']) if request.args.get('start') else None
+            range_end = parse_timestamp(request.args['end']) if request.args.get('end') else None
+        except ValueError:
+            return jsonify({'error': 'start e end devem ser datas ISO 8601'}), 400
+        order_id = request.args.get('order_id') or None
+        indexed = range_start is not None or range_end is not None or order_id is not None
+        if indexed and delta:
+            return jsonify({'error': 'start, end e order_id não podem ser combinados com cursor ou since'}), 400
+
+        etag = file_etag(stat, fmt, offset, limit, request.args.get('since'), start_offset,
+                         request.args.get('start'), request.args.get('end'), order_id)
+        if request.if_none_match.contains(etag): # arquivo não mudou desde a última leitura do cliente
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            response.headers['X-Next-Cursor'] = next_cursor
+            return response
+
+        variant = (fmt, offset, limit)
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        use_cache = payload_cache.max_bytes > 0 and not delta and not indexed # respostas incrementais/por índice são pequenas e variadas
+        if use_cache:
+            payload = payload_cache.get(variant, signature)
+            if payload is not None: # resposta já serializada para este arquivo: não relê o CSV
+                response = Response(payload, mimetype=mimetype)
+                response.set_etag(etag)
+                response.vary.add('Accept')
+                response.headers['X-Next-Cursor'] = next_cursor
+                return response, 200
+
+        skip = offset # pedidos a pular na leitura sequencial
+        if indexed: # o índice aponta as linhas; só elas são lidas do CSV
+            index = get_orders_index(stat, end)
+            if order_id is not None:
+                offsets = lookup_order_offsets(index, order_id)
+            else:
+                offsets = index.time_range(range_start, range_end)
+            offsets = offsets[offset:None if limit is None else offset + limit]
+            orders = iter_indexed_orders(index, offsets)
+            if order_id is not None and (range_start is not None or range_end is not None):
+                orders = (order for order in orders if in_time_range(order, range_start, range_end))
+            skip = 0
+        elif delta: # leitura incremental para na última linha completa (a que o próximo cursor aponta)
+            orders = iter_orders(since=since, start_offset=start_offset, end_offset=end)
+        elif offset: # página no meio do arquivo: o índice diz em que byte o pedido offset começa
+            index = get_orders_index(stat, end)
+            orders = iter_orders(start_offset=index.row_offsets[offset], end_offset=end) if offset < index.rows else iter(())
+            skip = 0
+        elif use_columnar_parser(): # arquivo inteiro: lê e serializa em blocos de colunas
+            orders = None
+            body = stream_columnar(offset, limit, fmt, end)
+        else: # também para na última linha completa: a mesma que X-Next-Cursor aponta
+            orders = iter_orders(end_offset=end)
+        if orders is not None:
+            orders = islice(orders, skip, None if limit is None else skip + limit) # pagina sem materializar a lista
+            body = {'json': stream_json_array, 'ndjson': stream_ndjson, 'binary': stream_binary}[fmt](orders)
+        if use_cache:
+            body = cache_payload(body, variant, signature)
+        response = Response(stream_with_context(body), mimetype=mimetype) # envia os chunks conforme são gerados
+        response.set_etag(etag)
+        response.vary.add('Accept') # o formato pode vir do header Accept
+        response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/health')
 def health():
-    """Endpoint de health check"""
-    return {'status': 'healthy'}, 200
+    """Endpoint de health check, com os contadores do cache de respostas"""
+    return {'status': 'healthy', 'cache': payload_cache.snapshot()}, 200
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato Prometheus (tempos de parse/serialização, vazão e cache)"""
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
 
 if __name__ == '__main__':
+    if os.path.exists(CSV_FILE): # monta (ou confere) o índice na subida, para a primeira consulta não esperar
+        def warm_index():
+            stat = os.stat(CSV_FILE)
+            get_orders_index(stat, complete_size(CSV_FILE, stat.st_size))
+        threading.Thread(target=warm_index, daemon=True).start()
     app.run(host='0.0.0.0', port=3000, debug=True)
-
-
@@ -0,0 +1,68 @@
+"""Testes do server.py com um orders.csv vazio ou com cabeçalho incompleto (ex.: durante a troca do arquivo).
+
+Uso (na pasta data-source, com as dependências de requirements.txt instaladas):
+    python -m unittest test_server
+"""
+import os
+import tempfile
+import unittest
+
+import server
+
+QUERIES = ['', '?offset=1', '?offset=0&limit=2', '?start=2024-01-01&end=2025-01-01', '?order_id=20240101-001']
+
+
+class EmptyCsvTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.csv = os.path.join(self.directory.name, 'orders.csv')
+        self.saved = (server.CSV_FILE, server.INDEX_FILE, server.orders_index, server.payload_cache.max_bytes)
+        server.CSV_FILE, server.INDEX_FILE, server.orders_index = self.csv, None, None
+        server.payload_cache.max_bytes = 0 # cada consulta relê o arquivo
+        self.client = server.app.test_client()
+
+    def tearDown(self):
+        server.CSV_FILE, server.INDEX_FILE, server.orders_index, server.payload_cache.max_bytes = self.saved
+
+    def write(self, content):
+        with open(self.csv, 'w', encoding='utf-8') as file:
+            file.write(content)
+
+    def assert_empty(self, query):
+        """Toda consulta (completa, paginada ou pelo índice) responde lista vazia com o mesmo cursor"""
+        cursor = f'{os.stat(self.csv).st_ino}:0'
+        for engine in ('python', 'arrow'):
+            server.CSV_ENGINE = engine
+            with self.subTest(query=query, engine=engine):
+                response = self.client.get('/' + query)
+                self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+                self.assertEqual(response.get_json(), [])
+                self.assertEqual(response.headers['X-Next-Cursor'], cursor)
+
+    def test_empty_file(self):
+        self.write('')
+        for query in QUERIES:
+            self.assert_empty(query)
+
+    def test_incomplete_header(self):
+        self.write('order_id;created_at;sta')
+        for query in QUERIES:
+            self.assert_empty(query)
+
+    def test_index_rebuilt_after_file_is_written(self):
+        self.write('')
+        self.assert_empty('?order_id=20240101-001')
+        with open(self.csv, 'a', encoding='utf-8') as file: # mesmo inode: o índice vazio não pode ser reaproveitado
+            file.write('order_id;created_at;status;value;payment_method\n'
+                       '20240101-001;2024-01-01T10:00:00Z;approved;10,5;pix\n'
+                       '20240102-001;2024-01-02T10:00:00Z;pending;20;boleto\n')
+        response = self.client.get('/?order_id=20240101-001')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['value'] for order in response.get_json()], [10.5])
+        response = self.client.get('/?offset=1')
+        self.assertEqual([order['order_id'] for order in response.get_json()], ['20240102-001'])
+
+
+if __name__ == '__main__':
+    unittest.main()
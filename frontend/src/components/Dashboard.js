@@ -76,7 +76,7 @@ function Dashboard() { // componente Dashboard que exibe os dados e filtros
     try {
       await backend1API.sync(token);
       alert('Dados de exemplo processados com sucesso!');
-      setTimeout(() => loadData(filters), 2000);
+      loadData(filters); // o job já esperou a transformação: as métricas refletem os pedidos novos
     } catch (err) {
       alert(err.response?.data?.error || 'Erro ao executar teste. Tente novamente.');
     } finally {
@@ -89,9 +89,12 @@ function Dashboard() { // componente Dashboard que exibe os dados e filtros
     try {
       await backend1API.syncWithFile(token, file);
       alert('Arquivo processado com sucesso!');
-      setTimeout(() => loadData(filters), 2000);
+      loadData(filters); // o job já esperou a transformação: as métricas refletem os pedidos novos
     } catch (err) {
       alert(err.response?.data?.error || 'Erro ao enviar arquivo. Tente novamente.');
+      if (err.response?.data?.batches_sent) {
+        loadData(filters); // ingestão parcial: os lotes já enviados estão gravados e agregados
+      }
     } finally {
       setUploadLoading(false);
     }
@@ -1,4 +1,5 @@
 import React, { createContext, useState, useContext } from 'react';
+import { backend1API } from '../services/api';
 
 const AuthContext = createContext();
 
@@ -14,6 +15,9 @@ export function AuthProvider({ children }) {
   };
 
   const logout = () => { // função para logout
+    if (token) {
+      backend1API.logout(token).catch(() => {}); // revoga o token no servidor; falha aqui não impede o logout local
+    }
     setToken(null); // define o token como null
     localStorage.removeItem('jwt_token'); // remove o token do localStorage
   };
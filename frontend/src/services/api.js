@@ -3,6 +3,31 @@ import axios from 'axios';
 const BACKEND1_URL = process.env.REACT_APP_BACKEND1_URL || 'http://localhost:5000';
 const BACKEND2_URL = process.env.REACT_APP_BACKEND2_URL || 'http://localhost:8080';
 
+const SYNC_JOB_POLL_INTERVAL_MS = 1000;
+
+// /sync e /sync/upload respondem 202 com um job; acompanha GET /sync/jobs/<id> até o job terminar.
+// O job só termina depois que o transformer agregou os pedidos inseridos (transform_state no job)
+const waitForSyncJob = async (token, job) => {
+  for (;;) {
+    const response = await axios.get(`${BACKEND1_URL}${job.status_url}`, {
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
+    const current = response.data;
+    if (current.state === 'succeeded') {
+      return current;
+    }
+    if (current.state === 'failed') {
+      // mesmo formato de erro do axios, para quem chama continuar lendo err.response.data.error
+      const error = new Error(current.error);
+      error.response = { status: current.status_code, data: current };
+      throw error;
+    }
+    await new Promise((resolve) => setTimeout(resolve, SYNC_JOB_POLL_INTERVAL_MS));
+  }
+};
+
 // funções para o frontend acessar o backend 1 (Auth & Trigger)
 export const backend1API = { // quando o frontend acessa o endpoint POST /login do Backend 1
   login: async (username, password) => { // faz uma requisição POST para o endpoint /login do Backend 1
@@ -19,7 +44,7 @@ export const backend1API = { // quando o frontend acessa o endpoint POST /login
         Authorization: `Bearer ${token}`, // envia o token
       },
     });
-    return response.data; // retorna a resposta da requisição
+    return waitForSyncJob(token, response.data); // aguarda o job de sincronização terminar
   },
 
   syncWithFile: async (token, file) => {
@@ -30,7 +55,15 @@ export const backend1API = { // quando o frontend acessa o endpoint POST /login
         Authorization: `Bearer ${token}`,
       },
     });
-    return response.data;
+    return waitForSyncJob(token, response.data);
+  },
+
+  logout: async (token) => { // revoga o token no Backend 1 (deixa de ser aceito mesmo antes de expirar, também no Backend 2, que lê as revogações do banco)
+    await axios.post(`${BACKEND1_URL}/logout`, {}, {
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
   },
 };
 
@@ -1,13 +1,21 @@
 package main
 
 import (
+	"bytes"
+	"context"
 	"database/sql"
+	"encoding/binary"
 	"encoding/json"
+	"errors"
 	"fmt"
+	"io"
 	"log"
+	"math"
 	"net/http"
+	"net/url"
 	"os"
 	"strings"
+	"sync"
 	"time"
 
 	_ "github.com/lib/pq"
@@ -29,12 +37,29 @@ type PipelineResponse struct {
 	Inserted  int    `json:"inserted"`
 	Total     int    `json:"total"`
 	Timestamp string `json:"timestamp"`
+	// id da execução do transformer que vai agregar os pedidos inseridos (GET /transform/runs/<id> no transformer);
+	// vazio quando nada foi inserido ou o transformer não respondeu
+	TransformRunID string `json:"transform_run_id,omitempty"`
 }
 
+// formato binário colunar servido pelo data-source e enviado pelo backend1 no upload (ver decodeOrdersBinary)
+const ordersBinaryContentType = "application/x-orders-binary"
+
+var ordersBinaryMagic = []byte("ORDB\x01") // assinatura + versão do formato
+
+// advisory lock da ingestão (INGEST_LOCK_ID no transformer): segurado compartilhado durante cada lote
+// de insertOrders, para o transformer só ler MAX(id) quando nenhum INSERT estiver em andamento
+const ingestLockID = 7261002
+
 var db *sql.DB
 var dataSourceURL string  // var global
 var transformerURL string // var global
 
+// cursor devolvido pelo data-source (header X-Next-Cursor) na última ingestão bem-sucedida;
+// vazio significa ler o arquivo inteiro
+var dataSourceCursor string
+var dataSourceCursorMu sync.Mutex
+
 func main() {
 	fmt.Println("=== Pipeline de Dados iniciado ===")
 
@@ -126,22 +151,33 @@ func triggerHandler(w http.ResponseWriter, r *http.Request) { // função que di
 
 	// Se o body contiver JSON com array de orders, usa esses dados; senão busca do data-source
 	var orders []Order
+	if r.Body != nil && r.Header.Get("Content-Type") == ordersBinaryContentType {
+		orders, err := decodeOrdersBinary(r.Body)
+		if err != nil {
+			http.Error(w, err.Error(), http.StatusBadRequest) // corpo binário corrompido: não cai na busca do data-source
+			return
+		}
+		fmt.Printf("✅ %d pedidos recebidos no body da requisição (binário)\n", len(orders))
+		inserted, total, runID, err := runPipelineWithOrders(orders)
+		writeTriggerResponse(w, inserted, total, runID, err)
+		return
+	}
 	if r.Body != nil && r.Header.Get("Content-Type") == "application/json" {
 		if err := json.NewDecoder(r.Body).Decode(&orders); err == nil && len(orders) > 0 {
 			fmt.Printf("✅ %d pedidos recebidos no body da requisição\n", len(orders))
-			inserted, total, err := runPipelineWithOrders(orders)
-			writeTriggerResponse(w, inserted, total, err)
+			inserted, total, runID, err := runPipelineWithOrders(orders)
+			writeTriggerResponse(w, inserted, total, runID, err)
 			return
 		}
 	}
 
 	// Executar pipeline (busca dados do data-source)
-	inserted, total, err := runPipeline() // executa o processo de ingestão de dados no PostgreSQL
+	inserted, total, runID, err := runPipeline() // executa o processo de ingestão de dados no PostgreSQL
 
-	writeTriggerResponse(w, inserted, total, err)
+	writeTriggerResponse(w, inserted, total, runID, err)
 }
 
-func writeTriggerResponse(w http.ResponseWriter, inserted, total int, err error) {
+func writeTriggerResponse(w http.ResponseWriter, inserted, total int, runID string, err error) {
 	response := PipelineResponse{
 		Success:   err == nil,
 		Timestamp: time.Now().Format(time.RFC3339),
@@ -156,35 +192,39 @@ func writeTriggerResponse(w http.ResponseWriter, inserted, total int, err error)
 	response.Message = "Pipeline executado com sucesso"
 	response.Inserted = inserted
 	response.Total = total
+	response.TransformRunID = runID
 	w.Header().Set("Content-Type", "application/json")
 	json.NewEncoder(w).Encode(response)
 }
 
-func runPipelineWithOrders(orders []Order) (int, int, error) {
+func runPipelineWithOrders(orders []Order) (int, int, string, error) {
 	fmt.Println("\n💾 Inserindo dados no PostgreSQL...")
 	inserted, err := insertOrders(db, orders)
 	if err != nil {
-		return 0, len(orders), fmt.Errorf("erro ao inserir pedidos: %w", err)
+		return 0, len(orders), "", fmt.Errorf("erro ao inserir pedidos: %w", err)
 	}
 	fmt.Printf("✅ %d pedidos inseridos com sucesso\n", inserted)
+	runID := ""
 	if inserted > 0 {
 		fmt.Println("\n🔄 Chamando transformer para agregar dados...")
-		if err := callTransformer(transformerURL); err != nil {
+		if runID, err = callTransformer(transformerURL); err != nil {
 			log.Printf("⚠️  Erro ao chamar transformer: %v", err)
 		} else {
-			fmt.Println("✅ Transformer executado com sucesso")
+			fmt.Printf("✅ Transformação agendada no transformer (execução %s)\n", runID)
 		}
 	}
 	fmt.Println("\n=== Pipeline concluído com sucesso ===")
-	return inserted, len(orders), nil
+	return inserted, len(orders), runID, nil
 }
 
-func runPipeline() (int, int, error) { // retorna 2 int e 1 error
+func runPipeline() (int, int, string, error) { // retorna 2 int, o id da execução do transformer e 1 error
 	// Buscar dados do Data Source
 	fmt.Println("\n📥 Buscando dados do Data Source...")
-	orders, err := fetchOrders(dataSourceURL) // fetchOrders é uma função que busca os pedidos da API do Data Source
+	dataSourceCursorMu.Lock() // uma ingestão incremental por vez, para o cursor não andar fora de ordem
+	defer dataSourceCursorMu.Unlock()
+	orders, nextCursor, err := fetchOrders(dataSourceURL, dataSourceCursor) // fetchOrders é uma função que busca os pedidos da API do Data Source
 	if err != nil {
-		return 0, 0, fmt.Errorf("erro ao buscar pedidos: %w", err)
+		return 0, 0, "", fmt.Errorf("erro ao buscar pedidos: %w", err)
 	}
 	fmt.Printf("✅ %d pedidos recebidos do Data Source\n", len(orders)) // qtd de pedidos recebidos
 
@@ -192,23 +232,25 @@ func runPipeline() (int, int, error) { // retorna 2 int e 1 error
 	fmt.Println("\n💾 Inserindo dados no PostgreSQL...")
 	inserted, err := insertOrders(db, orders) // insertOrders é uma função que insere os pedidos no banco de dados
 	if err != nil {
-		return 0, len(orders), fmt.Errorf("erro ao inserir pedidos: %w", err)
+		return 0, len(orders), "", fmt.Errorf("erro ao inserir pedidos: %w", err)
 	}
 	fmt.Printf("✅ %d pedidos inseridos com sucesso\n", inserted) // qtd de pedidos inseridos
+	dataSourceCursor = nextCursor                                // só avança o cursor depois que os pedidos foram gravados
 
 	// Chamar transformer para agregar dados
+	runID := ""
 	if inserted > 0 {
 		fmt.Println("\n🔄 Chamando transformer para agregar dados...")
-		if err := callTransformer(transformerURL); err != nil { // callTransformer é uma função que chama o serviço transformer via HTTP
+		if runID, err = callTransformer(transformerURL); err != nil { // callTransformer é uma função que chama o serviço transformer via HTTP
 			log.Printf("⚠️  Erro ao chamar transformer: %v", err)
 			// Não falhar o pipeline se o transformer falhar
 		} else {
-			fmt.Println("✅ Transformer executado com sucesso")
+			fmt.Printf("✅ Transformação agendada no transformer (execução %s)\n", runID)
 		}
 	}
 
 	fmt.Println("\n=== Pipeline concluído com sucesso ===")
-	return inserted, len(orders), nil
+	return inserted, len(orders), runID, nil
 }
 
 // setupDatabase cria o schema raw_data e a tabela orders se não existirem
@@ -240,28 +282,162 @@ func setupDatabase(db *sql.DB) error {
 	return nil
 }
 
-// fetchOrders busca os pedidos da API do Data Source
-func fetchOrders(url string) ([]Order, error) {
+// fetchOrders busca os pedidos da API do Data Source. Com cursor, busca só os pedidos adicionados
+// depois da última leitura; retorna também o cursor para a próxima chamada
+func fetchOrders(sourceURL string, cursor string) ([]Order, string, error) {
 	client := &http.Client{
 		Timeout: 30 * time.Second,
 	}
 
-	resp, err := client.Get(url) // faz uma requisição GET para a URL para obter os dados do Data Source
+	requestURL := sourceURL
+	if cursor != "" {
+		requestURL = sourceURL + "?cursor=" + url.QueryEscape(cursor)
+	}
+
+	req, err := http.NewRequest(http.MethodGet, requestURL, nil)
+	if err != nil {
+		return nil, "", fmt.Errorf("erro ao montar requisição HTTP: %w", err)
+	}
+	// prefere o formato binário colunar; um data-source que não o conheça responde JSON
+	req.Header.Set("Accept", ordersBinaryContentType+", application/json;q=0.9")
+
+	resp, err := client.Do(req) // faz uma requisição GET para a URL para obter os dados do Data Source
 	if err != nil {
-		return nil, fmt.Errorf("erro ao fazer requisição HTTP: %w", err)
+		return nil, "", fmt.Errorf("erro ao fazer requisição HTTP: %w", err)
 	}
 	defer resp.Body.Close()
 
+	if resp.StatusCode == http.StatusConflict && cursor != "" { // cursor não vale mais (arquivo trocado ou truncado): lê tudo de novo
+		fmt.Println("⚠️  Cursor do Data Source inválido, refazendo leitura completa")
+		return fetchOrders(sourceURL, "")
+	}
+
 	if resp.StatusCode != http.StatusOK { // status ok = 200
-		return nil, fmt.Errorf("status code não OK: %d", resp.StatusCode)
+		return nil, "", fmt.Errorf("status code não OK: %d", resp.StatusCode)
 	}
 
-	var orders []Order                                                 // orders é um slice de Order. Order é uma ficha de pedido, e []Order é uma pasta com várias fichas
-	if err := json.NewDecoder(resp.Body).Decode(&orders); err != nil { // decodifica o JSON da resposta, passando de JSON para Go
-		return nil, fmt.Errorf("erro ao decodificar JSON: %w", err)
+	var orders []Order // orders é um slice de Order. Order é uma ficha de pedido, e []Order é uma pasta com várias fichas
+	if strings.HasPrefix(resp.Header.Get("Content-Type"), ordersBinaryContentType) {
+		if orders, err = decodeOrdersBinary(resp.Body); err != nil {
+			return nil, "", err
+		}
+	} else if err := json.NewDecoder(resp.Body).Decode(&orders); err != nil { // decodifica o JSON da resposta, passando de JSON para Go
+		return nil, "", fmt.Errorf("erro ao decodificar JSON: %w", err)
+	}
+
+	return orders, resp.Header.Get("X-Next-Cursor"), nil // retorna os pedidos em formato Go e o próximo cursor, ou erro se houver
+}
+
+// binaryReader lê os campos do formato binário colunar; o primeiro erro interrompe as leituras seguintes
+type binaryReader struct {
+	data []byte
+	pos  int
+	err  error
+}
+
+func (b *binaryReader) next(n int) []byte {
+	if b.err != nil {
+		return nil
 	}
+	if n < 0 || n > len(b.data)-b.pos {
+		b.err = errors.New("dados truncados")
+		return nil
+	}
+	out := b.data[b.pos : b.pos+n]
+	b.pos += n
+	return out
+}
 
-	return orders, nil // retorna os pedidos em formato Go ou erro se houver
+func (b *binaryReader) uint32() int {
+	raw := b.next(4)
+	if raw == nil {
+		return 0
+	}
+	return int(binary.LittleEndian.Uint32(raw))
+}
+
+// strings lê uma coluna de texto: n + 1 offsets uint32 seguidos dos bytes UTF-8 concatenados
+func (b *binaryReader) strings(n int) []string {
+	offsets := b.next(4 * (n + 1))
+	if offsets == nil {
+		return nil
+	}
+	size := binary.LittleEndian.Uint32(offsets[4*n:])
+	data := string(b.next(int(size))) // uma única cópia; os textos da coluna são fatias dela
+	if b.err != nil {
+		return nil
+	}
+	out := make([]string, n)
+	start := binary.LittleEndian.Uint32(offsets)
+	for i := range out {
+		end := binary.LittleEndian.Uint32(offsets[4*(i+1):])
+		if start > end || end > size {
+			b.err = errors.New("offsets inválidos")
+			return nil
+		}
+		out[i] = data[start:end]
+		start = end
+	}
+	return out
+}
+
+// dictionary lê uma coluna codificada como dicionário: k textos distintos e um índice uint32 por pedido
+func (b *binaryReader) dictionary(n int) []string {
+	values := b.strings(b.uint32())
+	indices := b.next(4 * n)
+	if b.err != nil {
+		return nil
+	}
+	out := make([]string, n)
+	for i := range out {
+		index := binary.LittleEndian.Uint32(indices[4*i:])
+		if int(index) >= len(values) {
+			b.err = errors.New("índice de dicionário inválido")
+			return nil
+		}
+		out[i] = values[index]
+	}
+	return out
+}
+
+// decodeOrdersBinary decodifica o formato binário colunar (application/x-orders-binary):
+// a assinatura ORDB\x01 seguida de blocos com uint32 n; order_id e created_at como texto;
+// status como dicionário; value como n float64; payment_method como dicionário. Tudo em little-endian.
+func decodeOrdersBinary(body io.Reader) ([]Order, error) {
+	data, err := io.ReadAll(body)
+	if err != nil {
+		return nil, fmt.Errorf("erro ao ler corpo binário: %w", err)
+	}
+	if !bytes.HasPrefix(data, ordersBinaryMagic) {
+		return nil, errors.New("erro ao decodificar formato binário: assinatura inválida")
+	}
+
+	reader := &binaryReader{data: data, pos: len(ordersBinaryMagic)}
+	var orders []Order
+	for reader.err == nil && reader.pos < len(data) {
+		n := reader.uint32()
+		orderIDs := reader.strings(n)
+		createdAt := reader.strings(n)
+		statuses := reader.dictionary(n)
+		values := reader.next(8 * n)
+		paymentMethods := reader.dictionary(n)
+		if reader.err != nil {
+			break
+		}
+		for i := 0; i < n; i++ {
+			orders = append(orders, Order{
+				OrderID:       orderIDs[i],
+				CreatedAt:     createdAt[i],
+				Status:        statuses[i],
+				Value:         math.Float64frombits(binary.LittleEndian.Uint64(values[8*i:])),
+				PaymentMethod: paymentMethods[i],
+			})
+		}
+	}
+	if reader.err != nil {
+		return nil, fmt.Errorf("erro ao decodificar formato binário: %w", reader.err)
+	}
+	return orders, nil
 }
 
 // insertOrders insere os pedidos no banco de dados
@@ -270,8 +446,22 @@ func insertOrders(db *sql.DB, orders []Order) (int, error) {
 		return 0, nil
 	}
 
+	// Os INSERTs rodam numa conexão dedicada que segura o lock de ingestão compartilhado até o fim do lote.
+	// Cada INSERT confirma sozinho e os ids podem confirmar fora de ordem; sem o lock, o transformer poderia
+	// ler MAX(id) com um id menor ainda não confirmado e deixá-lo para sempre abaixo da marca d'água
+	ctx := context.Background()
+	conn, err := db.Conn(ctx)
+	if err != nil {
+		return 0, fmt.Errorf("erro ao obter conexão: %w", err)
+	}
+	defer conn.Close()
+	if _, err := conn.ExecContext(ctx, "SELECT pg_advisory_lock_shared($1)", ingestLockID); err != nil {
+		return 0, fmt.Errorf("erro ao obter lock de ingestão: %w", err)
+	}
+	defer conn.ExecContext(ctx, "SELECT pg_advisory_unlock_shared($1)", ingestLockID) // roda antes de conn.Close (defers em ordem inversa)
+
 	// Preparar statement (stmt) SQL para inserção, cria um template SQL que será executado posteriormente com os valores passados
-	stmt, err := db.Prepare(` 
+	stmt, err := conn.PrepareContext(ctx, ` 
 		INSERT INTO raw_data.orders (order_id, created_at, status, value, payment_method)
 		VALUES ($1, $2, $3, $4, $5)
 		ON CONFLICT (order_id) DO NOTHING
@@ -312,21 +502,28 @@ func insertOrders(db *sql.DB, orders []Order) (int, error) {
 	return inserted, nil
 }
 
-// callTransformer chama o serviço transformer via HTTP
-func callTransformer(url string) error {
+// callTransformer chama o serviço transformer via HTTP e retorna o id da execução agendada (run_id)
+func callTransformer(url string) (string, error) {
 	client := &http.Client{ // acessa o endpoint do transformer via HTTP
 		Timeout: 30 * time.Second,
 	}
 
 	resp, err := client.Post(url, "application/json", nil) // faz uma requisição POST (pois executa transformação nos dados) para a URL
 	if err != nil {
-		return fmt.Errorf("erro ao fazer requisição HTTP: %w", err)
+		return "", fmt.Errorf("erro ao fazer requisição HTTP: %w", err)
 	}
 	defer resp.Body.Close()
 
-	if resp.StatusCode != http.StatusOK {
-		return fmt.Errorf("status code não OK: %d", resp.StatusCode)
+	// 202: a transformação foi agendada (ou agrupada numa execução pendente) e roda em segundo plano no transformer
+	if resp.StatusCode != http.StatusOK && resp.StatusCode != http.StatusAccepted {
+		return "", fmt.Errorf("status code não OK: %d", resp.StatusCode)
 	}
 
-	return nil
+	var scheduled struct {
+		RunID string `json:"run_id"`
+	}
+	if err := json.NewDecoder(resp.Body).Decode(&scheduled); err != nil {
+		return "", fmt.Errorf("resposta do transformer inválida: %w", err)
+	}
+	return scheduled.RunID, nil
 }
@@ -0,0 +1,44 @@
+package main
+
+import (
+	"bytes"
+	"encoding/json"
+	"os"
+	"path/filepath"
+	"reflect"
+	"testing"
+)
+
+// Os corpos em testdata vêm dos codificadores Python do data-source e do backend1-auth
+// (testdata/generate_binary_fixtures.py); todos devem decodificar para os pedidos de orders.json
+func TestDecodeOrdersBinaryFixtures(t *testing.T) {
+	expectedJSON, err := os.ReadFile(filepath.Join("testdata", "orders.json"))
+	if err != nil {
+		t.Fatal(err)
+	}
+	var expected []Order
+	if err := json.Unmarshal(expectedJSON, &expected); err != nil {
+		t.Fatal(err)
+	}
+
+	for _, name := range []string{"data_source_rows.bin", "data_source_columns.bin", "backend1_rows.bin", "backend1_table.bin"} {
+		t.Run(name, func(t *testing.T) {
+			body, err := os.ReadFile(filepath.Join("testdata", name))
+			if err != nil {
+				t.Fatal(err)
+			}
+			orders, err := decodeOrdersBinary(bytes.NewReader(body))
+			if err != nil {
+				t.Fatalf("erro ao decodificar: %v", err)
+			}
+			if !reflect.DeepEqual(orders, expected) {
+				t.Fatalf("pedidos decodificados diferem de orders.json:\n got: %+v\nwant: %+v", orders, expected)
+			}
+
+			// corpo truncado no meio de um bloco deve falhar, não virar pedidos parciais
+			if _, err := decodeOrdersBinary(bytes.NewReader(body[:len(body)-1])); err == nil {
+				t.Fatal("corpo truncado decodificado sem erro")
+			}
+		})
+	}
+}
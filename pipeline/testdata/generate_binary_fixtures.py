@@ -0,0 +1,106 @@
+"""Gera os corpos binários (application/x-orders-binary) usados em main_test.go, um por codificador Python.
+
+O formato tem três implementações independentes: os codificadores do data-source (server.py) e do
+backend1-auth (app.py), cada um com uma versão por dicts e outra por colunas Arrow, e o decoder do
+pipeline (decodeOrdersBinary). Os mesmos ORDERS passam por cada codificador; main_test.go decodifica
+cada arquivo e compara com orders.json.
+
+Uso (na raiz do repositório, com as dependências do data-source e do backend1-auth instaladas):
+    python pipeline/testdata/generate_binary_fixtures.py          # regrava os arquivos
+    python pipeline/testdata/generate_binary_fixtures.py --check  # sai com código 1 se algum codificador mudou a saída
+
+Depois, na pasta pipeline (o módulo Go só é criado no Dockerfile):
+    go mod init pipeline && go get github.com/lib/pq && go test ./...
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+
+import pyarrow as pa
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE)) # raiz do repositório
+ORDER_COLUMNS = ['order_id', 'created_at', 'status', 'value', 'payment_method']
+
+# Pedidos dos fixtures: textos com acentos e vazios, status/formas de pagamento repetidos e valores
+# que exercitam o float64 (centavos, zero, negativo, grandes)
+ORDERS = [
+    {'order_id': '20260120-001', 'created_at': '2026-01-20T08:15:00Z', 'status': 'approved', 'value': 129.9, 'payment_method': 'pix'},
+    {'order_id': '20260120-002', 'created_at': '2026-01-20T09:02:31Z', 'status': 'pending', 'value': 0.0, 'payment_method': 'boleto'},
+    {'order_id': '20260120-003', 'created_at': '2026-01-20T10:45:12Z', 'status': 'cancelled', 'value': 1999.99, 'payment_method': 'credit_card'},
+    {'order_id': 'pedido-ação-ü', 'created_at': '2026-01-21T00:00:00Z', 'status': 'approved', 'value': -15.5, 'payment_method': 'pix'},
+    {'order_id': '20260121-002', 'created_at': '2026-01-21T23:59:59Z', 'status': 'approved', 'value': 12345678.01, 'payment_method': 'credit_card'},
+    {'order_id': '', 'created_at': '2026-01-22T12:00:00Z', 'status': '', 'value': 0.01, 'payment_method': 'boleto'},
+    {'order_id': '20260122-002', 'created_at': '2026-01-22T12:30:00Z', 'status': 'pending', 'value': 49.5, 'payment_method': 'pix'},
+]
+SPLIT = 3 # fixtures com mais de um bloco cortam os pedidos aqui
+
+
+def load_service(name, relative_path):
+    """Importa o arquivo principal de um serviço (os diretórios têm hífen e não são pacotes)"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def padded_columns(orders):
+    """Colunas Arrow dos pedidos com uma linha extra no início, removida por slice (exercita o offset dos buffers)"""
+    padding = {'order_id': 'x', 'created_at': 'x', 'status': 'x', 'value': 1.0, 'payment_method': 'x'}
+    table = pa.Table.from_pylist([padding] + orders)
+    return {name: table.column(name).combine_chunks().slice(1) for name in ORDER_COLUMNS}
+
+
+def build_fixtures():
+    """Retorna {nome do arquivo: corpo binário} com a saída de cada codificador para ORDERS"""
+    data_source = load_service('data_source_server', 'data-source/server.py')
+    backend1 = load_service('backend1_app', 'backend1-auth/app.py')
+
+    # data-source: BINARY_MAGIC seguido de um bloco por lote (dois lotes aqui)
+    columns = padded_columns(ORDERS)
+    first = {name: column.slice(0, SPLIT) for name, column in columns.items()}
+    rest = {name: column.slice(SPLIT) for name, column in columns.items()}
+
+    # backend1: um corpo por lote, já com BINARY_MAGIC; a tabela chega em vários chunks do leitor CSV
+    table = pa.concat_tables([pa.Table.from_pylist(ORDERS[:SPLIT]), pa.Table.from_pylist(ORDERS[SPLIT:])])
+
+    return {
+        'data_source_rows.bin': data_source.BINARY_MAGIC + data_source.encode_binary_rows(ORDERS[:SPLIT]) + data_source.encode_binary_rows(ORDERS[SPLIT:]),
+        'data_source_columns.bin': data_source.BINARY_MAGIC + data_source.encode_binary_columns(first) + data_source.encode_binary_columns(rest),
+        'backend1_rows.bin': backend1.encode_binary_rows(ORDERS),
+        'backend1_table.bin': backend1.encode_binary_table(table),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera (ou confere) os corpos binários de pipeline/testdata')
+    parser.add_argument('--check', action='store_true', help='só compara com os arquivos existentes; código 1 se diferirem')
+    args = parser.parse_args()
+
+    fixtures = build_fixtures()
+    fixtures['orders.json'] = (json.dumps(ORDERS, indent=2, ensure_ascii=False) + '\n').encode('utf-8')
+
+    changed = []
+    for name, body in fixtures.items():
+        path = os.path.join(HERE, name)
+        if args.check:
+            with open(path, 'rb') as file:
+                if file.read() != body:
+                    changed.append(name)
+            continue
+        with open(path, 'wb') as file:
+            file.write(body)
+        print(f"✅ {name} ({len(body)} bytes)")
+
+    if changed:
+        print(f"❌ Saída diferente dos arquivos em pipeline/testdata: {', '.join(changed)}")
+        print("   Se o formato mudou de propósito, atualize decodeOrdersBinary e regenere os arquivos")
+        sys.exit(1)
+    if args.check:
+        print("✅ Todos os codificadores geram os corpos de pipeline/testdata")
+
+
+if __name__ == '__main__':
+    main()
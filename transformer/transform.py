@@ -1,11 +1,59 @@
+import datetime
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from flask import Flask, jsonify
+from psycopg2.extras import Json
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
 
-def get_database_connection():
-    """Conecta ao PostgreSQL usando DATABASE_URL"""
+WATERMARK_NAME = 'daily_metrics' # chave da marca d'água em aggregated.transform_state
+# Rollups mantidos a partir de aggregated.daily_metrics: tabela, coluna do período e duração do período
+ROLLUP_PERIODS = [
+    ('weekly_metrics', 'week_start', 'week'),
+    ('monthly_metrics', 'month', 'month'),
+]
+TRANSFORM_LOCK_ID = 7261001 # chave do advisory lock que serializa transformações entre workers/processos
+INGEST_LOCK_ID = 7261002 # advisory lock da ingestão: o pipeline o segura compartilhado enquanto insere em raw_data.orders (ver get_max_order_id)
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1')) # conexões mantidas abertas por processo
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '4')) # máximo de conexões por processo
+DB_POOL_CHECK_SECONDS = float(os.getenv('DB_POOL_CHECK_SECONDS', '30')) # conexões ociosas há mais tempo são testadas antes do uso
+DB_POOL_WAIT_SECONDS = float(os.getenv('DB_POOL_WAIT_SECONDS', '30')) # espera máxima por uma conexão livre quando as DB_POOL_MAX estão emprestadas
+
+# Reconstrução particionada (mode=partitioned): partições de raw_data.orders agregadas em paralelo
+REBUILD_WORKERS = int(os.getenv('REBUILD_WORKERS', str(os.cpu_count() or 2))) # partições processadas ao mesmo tempo (uma conexão cada)
+REBUILD_PARTITION = os.getenv('REBUILD_PARTITION', 'month') # tamanho da partição: day, week, month ou year
+
+# Agendador de /transform: gatilhos próximos viram uma única execução (ver TransformScheduler)
+TRANSFORM_DEBOUNCE_SECONDS = float(os.getenv('TRANSFORM_DEBOUNCE_SECONDS', '2')) # silêncio esperado antes de iniciar uma execução pendente
+TRANSFORM_DEBOUNCE_MAX_SECONDS = float(os.getenv('TRANSFORM_DEBOUNCE_MAX_SECONDS', '30')) # espera máxima desde o primeiro gatilho, mesmo com gatilhos contínuos
+TRANSFORM_RUN_TTL_SECONDS = int(os.getenv('TRANSFORM_RUN_TTL_SECONDS', '3600')) # por quanto tempo uma execução finalizada continua consultável
+MODE_PRIORITY = {'incremental': 0, 'full': 1, 'partitioned': 2} # gatilhos agrupados executam o modo mais abrangente pedido
+
+# Métricas Prometheus expostas em /metrics (modo multiprocesso quando PROMETHEUS_MULTIPROC_DIR está definido, no gunicorn)
+STAGE_SECONDS = Histogram('transformer_stage_seconds', 'Duração de cada etapa da transformação', ['stage'], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+RUN_SECONDS = Histogram('transformer_run_seconds', 'Duração total da transformação', ['mode'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900))
+RUNS = Counter('transformer_runs_total', 'Transformações executadas', ['mode', 'result'])
+GROUPS = Counter('transformer_groups_total', 'Grupos de daily_metrics processados', ['result'])
+TRIGGERS = Counter('transformer_triggers_total', 'Gatilhos recebidos em /transform', ['result'])
+QUEUE_SECONDS = Histogram('transformer_run_queue_seconds', 'Tempo entre o primeiro gatilho agrupado e o início da execução', buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 300, 900))
+PARTITION_SECONDS = Histogram('transformer_partition_seconds', 'Duração de cada partição da reconstrução particionada', buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX) # uma vaga por conexão: com mais threads que DB_POOL_MAX, as excedentes esperam em vez de receber PoolError
+_connection_last_used = {} # id(conexão) -> instante em que voltou ao pool
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def get_database_url():
+    """Lê DATABASE_URL e garante sslmode"""
     database_url = os.getenv("DATABASE_URL") # lê a variável de ambiente DATABASE_URL
     if not database_url:
         raise ValueError("DATABASE_URL não configurada")
@@ -16,13 +64,83 @@ def get_database_connection():
             database_url += "&sslmode=disable"
         else:
             database_url += "?sslmode=disable"
-    
-    # Conectar ao banco
-    conn = psycopg2.connect(database_url) # conecta ao banco de dados usando a URL de conexão
+    return database_url
+
+def get_database_connection():
+    """Conecta ao PostgreSQL usando DATABASE_URL (conexão avulsa, fora do pool)"""
+    conn = psycopg2.connect(get_database_url()) # conecta ao banco de dados usando a URL de conexão
     return conn
 
+def get_connection_pool():
+    """Retorna o pool de conexões do processo, criando-o no primeiro uso (depois do fork do gunicorn)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, get_database_url())
+            print(f"✅ Pool de conexões criado ({DB_POOL_MIN}-{DB_POOL_MAX} conexões)")
+        return _pool
+
+def connection_is_healthy(conn):
+    """Verifica se a conexão continua utilizável; conexões usadas há pouco não são testadas de novo"""
+    if conn.closed:
+        return False
+    last_used = _connection_last_used.get(id(conn))
+    if last_used is not None and time.monotonic() - last_used < DB_POOL_CHECK_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextmanager
+def pooled_connection():
+    """Empresta uma conexão saudável do pool e a devolve ao final (com rollback se houve erro).
+
+    Se as DB_POOL_MAX conexões estiverem emprestadas, espera até DB_POOL_WAIT_SECONDS por uma livre
+    (o ThreadedConnectionPool sozinho levantaria PoolError na hora).
+    """
+    if not _pool_slots.acquire(timeout=DB_POOL_WAIT_SECONDS):
+        raise PoolError(f"nenhuma conexão livre no pool após {DB_POOL_WAIT_SECONDS}s (DB_POOL_MAX={DB_POOL_MAX})")
+    try:
+        pool = get_connection_pool()
+        conn = pool.getconn()
+        while not connection_is_healthy(conn): # conexão caiu (restart do banco, timeout): descarta e pega outra
+            _connection_last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn.closed:
+                _connection_last_used.pop(id(conn), None)
+            else:
+                _connection_last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _pool_slots.release()
+
+def ensure_aggregated_schema(conn):
+    """Roda setup_aggregated_schema uma única vez por processo"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            print("\n🏗️  Configurando schema aggregated...")
+            _schema_ready = setup_aggregated_schema(conn)
+
 def setup_aggregated_schema(conn):
-    """Cria o schema aggregated e a tabela daily_metrics se não existirem"""
+    """Cria o schema aggregated e a tabela daily_metrics se não existirem.
+
+    Retorna False se raw_data.orders ainda não existe (o índice dela fica para a próxima chamada).
+    """
     with conn.cursor() as cur: # cursor é um objeto que permite executar consultas SQL
         # Criar schema aggregated se não existir
         cur.execute("CREATE SCHEMA IF NOT EXISTS aggregated")
@@ -42,101 +160,840 @@ def setup_aggregated_schema(conn):
         """
         cur.execute(create_table_sql) # executa o SQL de criação da tabela
         
+        # Tabela de estado do transformer: guarda a marca d'água (maior raw_data.orders.id já agregado)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS aggregated.transform_state (
+                name VARCHAR(50) PRIMARY KEY,
+                last_order_id BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Progresso da última reconstrução particionada: uma linha por partição, gravada junto com a partição
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS aggregated.rebuild_partitions (
+                partition_start DATE PRIMARY KEY,
+                partition_end DATE NOT NULL,
+                state VARCHAR(20) NOT NULL,
+                groups INTEGER,
+                inserted INTEGER,
+                updated INTEGER,
+                unchanged INTEGER,
+                deleted INTEGER,
+                seconds NUMERIC(10, 3),
+                error TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Execuções agendadas por POST /transform (cópia pública de TransformScheduler): GET /transform/runs/<id>
+        # responde em qualquer worker do gunicorn, não só no que recebeu o gatilho
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS aggregated.transform_runs (
+                id VARCHAR(32) PRIMARY KEY,
+                state VARCHAR(20) NOT NULL,
+                run JSONB NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Rollups mais grossos (semana, mês e total geral) para consultas de períodos longos no dashboard
+        for table, period_column, _ in ROLLUP_PERIODS:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS aggregated.{table} (
+                    id SERIAL PRIMARY KEY,
+                    {period_column} DATE NOT NULL,
+                    status VARCHAR(50) NOT NULL,
+                    payment_method VARCHAR(50) NOT NULL,
+                    total_orders BIGINT NOT NULL,
+                    total_value NUMERIC(16, 2) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE({period_column}, status, payment_method)
+                )
+            """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS aggregated.total_metrics (
+                id SERIAL PRIMARY KEY,
+                status VARCHAR(50) NOT NULL,
+                payment_method VARCHAR(50) NOT NULL,
+                total_orders BIGINT NOT NULL,
+                total_value NUMERIC(16, 2) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(status, payment_method)
+            )
+        """)
+        
+        # Rollups recém-criados com daily_metrics já populada: preenche a partir do histórico diário
+        cur.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM aggregated.total_metrics)
+                AND EXISTS (SELECT 1 FROM aggregated.daily_metrics)
+        """)
+        if cur.fetchone()[0]:
+            print("📊 Preenchendo rollups a partir de aggregated.daily_metrics...")
+            update_rollups(conn, all_periods=True)
+        
+        # Índice para reagregar só os grupos tocados sem varrer raw_data.orders inteira.
+        # raw_data.orders é criada pelo pipeline, então só cria o índice se a tabela já existir
+        cur.execute("SELECT to_regclass('raw_data.orders')")
+        raw_orders_exists = cur.fetchone()[0] is not None
+        if raw_orders_exists:
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS orders_date_status_payment_idx
+                ON raw_data.orders (DATE(created_at), status, payment_method)
+            """)
+        
         conn.commit()
         print("✅ Schema aggregated e tabela daily_metrics verificados/criados")
+        return raw_orders_exists
 
-def aggregate_data(conn):
-    """Lê dados de raw_data.orders e agrega por data, status e payment_method"""
-    with conn.cursor(cursor_factory=RealDictCursor) as cur: # retorna linhas como dicionários, para o acesso ser dado por nome de coluna, em vez de índice
-        # Query de agregação, query é uma consulta SQL que retorna os dados agregados por data, status e payment_method, é uma query de seleção (SELECT)
-        aggregation_sql = """
-            SELECT -- seleciona quais colunas serão retornadas
-                DATE(created_at) as date,
-                status,
-                payment_method,
-                COUNT(*) as total_orders,
-                SUM(value) as total_value
-            FROM raw_data.orders
-            GROUP BY DATE(created_at), status, payment_method  -- agrupa os que tem o mesmo date, status e payment_method
-            ORDER BY date, status, payment_method  -- ordena por date, status e payment_method
-        """
+def get_watermark(conn):
+    """Retorna o maior raw_data.orders.id já agregado (0 se o transformer nunca rodou)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_order_id FROM aggregated.transform_state WHERE name = %s", (WATERMARK_NAME,))
+        row = cur.fetchone()
+        return row[0] if row else 0
+
+def save_watermark(conn, last_order_id):
+    """Grava a marca d'água; não faz commit, para entrar na mesma transação do upsert"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO aggregated.transform_state (name, last_order_id)
+            VALUES (%s, %s)
+            ON CONFLICT (name) DO UPDATE SET
+                last_order_id = EXCLUDED.last_order_id,
+                updated_at = CURRENT_TIMESTAMP
+        """, (WATERMARK_NAME, last_order_id))
+
+def get_max_order_id(conn):
+    """Retorna o maior id presente em raw_data.orders (0 se a tabela estiver vazia).
+
+    O id vem de uma sequência, mas os INSERTs do pipeline confirmam fora de ordem: um id menor
+    pode aparecer depois de MAX(id) e ficaria para sempre abaixo da marca d'água. O pipeline
+    segura INGEST_LOCK_ID compartilhado durante cada lote; aqui ele é pego exclusivo só para ler
+    MAX(id), o que espera os lotes em andamento terminarem. Lotes que começam depois recebem ids
+    maiores que todos os já distribuídos.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (INGEST_LOCK_ID,))
+        try:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM raw_data.orders") # novo snapshot (READ COMMITTED): vê tudo o que os lotes confirmaram
+            max_order_id = cur.fetchone()[0]
+        except Exception:
+            conn.rollback() # o lock é de sessão e sobreviveria à volta da conexão ao pool; a transação abortada não aceita o unlock
+            cur.execute("SELECT pg_advisory_unlock(%s)", (INGEST_LOCK_ID,))
+            raise
+        cur.execute("SELECT pg_advisory_unlock(%s)", (INGEST_LOCK_ID,))
+        return max_order_id
+
+def aggregate_data(conn, since_id=None, until_id=None, date_from=None, date_to=None):
+    """Agrega raw_data.orders por data, status e payment_method numa tabela temporária de staging.
+
+    A agregação roda inteira dentro do PostgreSQL: as linhas resultantes ficam em
+    pg_temp.daily_metrics_staging (descartada no commit) e não passam pelo Python.
+    Sem since_id agrega a tabela inteira (reconstrução completa). Com since_id, só os grupos
+    (data, status, payment_method) que receberam pedidos com id em (since_id, until_id] são
+    reagregados — o resultado de cada grupo continua sendo o total completo do grupo.
+    Sem since_id, until_id limita os pedidos a id <= until_id e date_from/date_to limitam a
+    agregação às datas em [date_from, date_to) (uma partição da reconstrução particionada).
+    Retorna o número de grupos agregados.
+    """
+    with conn.cursor() as cur: # cursor é um objeto que permite executar consultas SQL
+        cur.execute("DROP TABLE IF EXISTS pg_temp.daily_metrics_staging")
+        cur.execute("""
+            CREATE TEMP TABLE daily_metrics_staging (
+                date DATE NOT NULL,
+                status VARCHAR(50) NOT NULL,
+                payment_method VARCHAR(50) NOT NULL,
+                total_orders INTEGER NOT NULL,
+                total_value NUMERIC(10, 2) NOT NULL
+            ) ON COMMIT DROP
+        """)
         
-        cur.execute(aggregation_sql) # executa o SQL de agregação
-        aggregated_data = cur.fetchall() # retorna as linhas resultantes da execução do SQL de agregação
+        if since_id is None:
+            # Filtros opcionais; DATE(created_at) usa o índice (DATE(created_at), status, payment_method)
+            conditions, params = [], []
+            if until_id is not None:
+                conditions.append("id <= %s")
+                params.append(until_id)
+            if date_from is not None:
+                conditions.append("DATE(created_at) >= %s")
+                params.append(date_from)
+            if date_to is not None:
+                conditions.append("DATE(created_at) < %s")
+                params.append(date_to)
+            where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
+            # Query de agregação, query é uma consulta SQL que retorna os dados agregados por data, status e payment_method
+            aggregation_sql = f"""
+                INSERT INTO daily_metrics_staging (date, status, payment_method, total_orders, total_value)
+                SELECT -- seleciona quais colunas serão gravadas no staging
+                    DATE(created_at) as date,
+                    status,
+                    payment_method,
+                    COUNT(*) as total_orders,
+                    SUM(value) as total_value
+                FROM raw_data.orders
+                {where_sql}
+                GROUP BY DATE(created_at), status, payment_method  -- agrupa os que tem o mesmo date, status e payment_method
+            """
+            cur.execute(aggregation_sql, params) # executa o SQL de agregação
+        else:
+            # Grupos tocados pelos pedidos novos; o JOIN usa o índice (DATE(created_at), status, payment_method)
+            aggregation_sql = """
+                INSERT INTO daily_metrics_staging (date, status, payment_method, total_orders, total_value)
+                WITH touched AS (
+                    SELECT DISTINCT DATE(created_at) AS date, status, payment_method
+                    FROM raw_data.orders
+                    WHERE id > %s AND id <= %s
+                )
+                SELECT
+                    t.date,
+                    t.status,
+                    t.payment_method,
+                    COUNT(*) as total_orders,
+                    SUM(o.value) as total_value
+                FROM touched t
+                JOIN raw_data.orders o
+                    ON DATE(o.created_at) = t.date
+                    AND o.status = t.status
+                    AND o.payment_method = t.payment_method
+                GROUP BY t.date, t.status, t.payment_method
+            """
+            cur.execute(aggregation_sql, (since_id, until_id))
+        staged_groups = cur.rowcount # número de grupos gravados no staging
         
-        print(f"✅ {len(aggregated_data)} grupos de dados agregados encontrados")
-        return aggregated_data
+        print(f"✅ {staged_groups} grupos de dados agregados encontrados")
+        return staged_groups
+
+def insert_aggregated_data(conn, staged_groups): # recebe a conexão e o número de grupos no staging e atualiza a tabela aggregated.daily_metrics
+    """Mescla o staging em aggregated.daily_metrics com um único INSERT ... ON CONFLICT.
 
-def insert_aggregated_data(conn, aggregated_data): # recebe a conexão e os dados agregados e atualiza a tabela aggregated.daily_metrics
-    """Insere os dados agregados na tabela aggregated.daily_metrics"""
-    if not aggregated_data:
+    Linhas cujo total não mudou não são reescritas. Não faz commit: os rollups são atualizados na
+    mesma transação. Retorna um dicionário com a contagem de grupos inseridos, atualizados e inalterados.
+    """
+    if not staged_groups:
         print("⚠️  Nenhum dado para inserir")
-        return 0
+        return {'inserted': 0, 'updated': 0, 'unchanged': 0}
     
-    with conn.cursor() as cur: # cursor é um objeto que permite executar consultas SQL
-        # Preparar statement de inserção, insere os dados agregados na tabela aggregated.daily_metrics.
-        insert_sql = """
-            INSERT INTO aggregated.daily_metrics
-                (date, status, payment_method, total_orders, total_value)
-            VALUES (%s, %s, %s, %s, %s) -- placeholders para os valores a serem inseridos na tabela aggregated.daily_metrics
-            ON CONFLICT (date, status, payment_method) -- se já existir uma linha com a mesma data, status e payment_method, atualiza os valores para os novos que está tentando inserir, ou mantém o mesmo se não for um dado novo (transformer roda novamente sem dados novos)
+    with conn.cursor() as cur:
+        # xmax = 0 identifica linhas recém-inseridas; as demais retornadas foram atualizadas.
+        # Grupos com os mesmos totais são barrados pelo WHERE e não aparecem no RETURNING (inalterados)
+        merge_sql = """
+            WITH upserted AS (
+                INSERT INTO aggregated.daily_metrics
+                    (date, status, payment_method, total_orders, total_value)
+                SELECT date, status, payment_method, total_orders, total_value
+                FROM daily_metrics_staging
+                ORDER BY date, status, payment_method  -- ordem estável das chaves evita deadlock entre execuções concorrentes
+                ON CONFLICT (date, status, payment_method) -- se já existir uma linha com a mesma data, status e payment_method, atualiza os valores
+                DO UPDATE SET
+                    total_orders = EXCLUDED.total_orders, -- excluded é o valor que você quer inserir, com os mesmos valores de date, status e payment_method que já existem
+                    total_value = EXCLUDED.total_value,
+                    created_at = CURRENT_TIMESTAMP
+                WHERE (aggregated.daily_metrics.total_orders, aggregated.daily_metrics.total_value)
+                    IS DISTINCT FROM (EXCLUDED.total_orders, EXCLUDED.total_value)
+                RETURNING (xmax = 0) AS is_insert
+            )
+            SELECT
+                COUNT(*) FILTER (WHERE is_insert),
+                COUNT(*) FILTER (WHERE NOT is_insert)
+            FROM upserted
+        """
+        cur.execute(merge_sql)
+        inserted, updated = cur.fetchone()
+        
+    return {
+        'inserted': inserted,
+        'updated': updated,
+        'unchanged': staged_groups - inserted - updated
+    }
+
+def update_rollups(conn, all_periods=False):
+    """Recalcula semanas, meses e totais gerais tocados pelo staging a partir de aggregated.daily_metrics.
+
+    Cada período tocado é recalculado inteiro (soma dos dias do período), então o resultado é o mesmo
+    de uma reagregação completa. all_periods=True recalcula todos os períodos existentes em daily_metrics.
+    Não faz commit.
+    """
+    source = 'aggregated.daily_metrics' if all_periods else 'daily_metrics_staging'
+    with conn.cursor() as cur:
+        for table, period_column, period in ROLLUP_PERIODS:
+            cur.execute(f"""
+                INSERT INTO aggregated.{table}
+                    ({period_column}, status, payment_method, total_orders, total_value)
+                SELECT t.period, t.status, t.payment_method, SUM(d.total_orders), SUM(d.total_value)
+                FROM (
+                    SELECT DISTINCT DATE_TRUNC('{period}', date)::date AS period, status, payment_method
+                    FROM {source}
+                ) t
+                JOIN aggregated.daily_metrics d
+                    ON d.status = t.status
+                    AND d.payment_method = t.payment_method
+                    AND d.date >= t.period
+                    AND d.date < t.period + INTERVAL '1 {period}'
+                GROUP BY t.period, t.status, t.payment_method
+                ORDER BY t.period, t.status, t.payment_method
+                ON CONFLICT ({period_column}, status, payment_method)
+                DO UPDATE SET
+                    total_orders = EXCLUDED.total_orders,
+                    total_value = EXCLUDED.total_value,
+                    created_at = CURRENT_TIMESTAMP
+                WHERE (aggregated.{table}.total_orders, aggregated.{table}.total_value)
+                    IS DISTINCT FROM (EXCLUDED.total_orders, EXCLUDED.total_value)
+            """)
+            print(f"✅ {cur.rowcount} linhas de aggregated.{table} atualizadas")
+        
+        # Total geral por status/payment_method, somando os meses (já atualizados acima)
+        cur.execute(f"""
+            INSERT INTO aggregated.total_metrics (status, payment_method, total_orders, total_value)
+            SELECT m.status, m.payment_method, SUM(m.total_orders), SUM(m.total_value)
+            FROM aggregated.monthly_metrics m
+            JOIN (SELECT DISTINCT status, payment_method FROM {source}) t
+                ON m.status = t.status AND m.payment_method = t.payment_method
+            GROUP BY m.status, m.payment_method
+            ORDER BY m.status, m.payment_method
+            ON CONFLICT (status, payment_method)
             DO UPDATE SET
-                total_orders = EXCLUDED.total_orders, -- excluded é o valor que você quer inserir, com os mesmos valores de date, status e payment_method que já existem
+                total_orders = EXCLUDED.total_orders,
                 total_value = EXCLUDED.total_value,
                 created_at = CURRENT_TIMESTAMP
-        """
-        
-        inserted = 0
-        for row in aggregated_data: # para cada linha na lista de dados agregados, insere na tabela aggregated.daily_metrics; Executa o statement preparado para cada linha
-            try:
-                cur.execute(
-                    insert_sql, # insere os valores nos placeholders
-                    (
-                        row['date'],
-                        row['status'],
-                        row['payment_method'],
-                        row['total_orders'],
-                        float(row['total_value'])
-                    )
+            WHERE (aggregated.total_metrics.total_orders, aggregated.total_metrics.total_value)
+                IS DISTINCT FROM (EXCLUDED.total_orders, EXCLUDED.total_value)
+        """)
+        print(f"✅ {cur.rowcount} linhas de aggregated.total_metrics atualizadas")
+
+def delete_stale_groups(conn, date_from, date_to):
+    """Apaga de aggregated.daily_metrics os grupos em [date_from, date_to) que não estão no staging.
+
+    Usado na reconstrução de uma partição: pedidos corrigidos ou removidos de raw_data.orders não
+    deixam grupos antigos para trás. Não faz commit. Retorna o número de grupos apagados.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM aggregated.daily_metrics d
+            WHERE d.date >= %s AND d.date < %s
+                AND NOT EXISTS (
+                    SELECT 1 FROM daily_metrics_staging s
+                    WHERE s.date = d.date AND s.status = d.status AND s.payment_method = d.payment_method
                 )
-                inserted += 1
-            except Exception as e: # se houver erro, imprime o erro e continua para a próxima linha
-                print(f"⚠️  Erro ao inserir linha: {e}")
-                continue
-        
-        conn.commit() # confirma a transação, ou seja, insere as linhas na tabela aggregated.daily_metrics. antes disso, ficam como pendentes
-        return inserted # retorna o número de linhas inseridas
+        """, (date_from, date_to))
+        return cur.rowcount
+
+def rebuild_rollups(conn, date_from, date_to):
+    """Recalcula os rollups semanais e mensais dos períodos inteiramente contidos em [date_from, date_to).
+
+    Usado dentro da transação de cada partição da reconstrução: semanas e meses da partição ficam
+    visíveis junto com os dias dela. Períodos que atravessam o limite da partição dependem de outra
+    partição e ficam para rebuild_boundary_rollups. Linhas de rollup sem nenhum dia correspondente
+    são apagadas. Não faz commit.
+    """
+    with conn.cursor() as cur:
+        for table, period_column, period in ROLLUP_PERIODS:
+            cur.execute(f"""
+                INSERT INTO aggregated.{table}
+                    ({period_column}, status, payment_method, total_orders, total_value)
+                SELECT DATE_TRUNC('{period}', date)::date, status, payment_method, SUM(total_orders), SUM(total_value)
+                FROM aggregated.daily_metrics
+                WHERE date >= %(date_from)s AND date < %(date_to)s
+                    AND DATE_TRUNC('{period}', date) >= %(date_from)s
+                    AND DATE_TRUNC('{period}', date) + INTERVAL '1 {period}' <= %(date_to)s
+                GROUP BY 1, status, payment_method
+                ORDER BY 1, status, payment_method
+                ON CONFLICT ({period_column}, status, payment_method)
+                DO UPDATE SET
+                    total_orders = EXCLUDED.total_orders,
+                    total_value = EXCLUDED.total_value,
+                    created_at = CURRENT_TIMESTAMP
+                WHERE (aggregated.{table}.total_orders, aggregated.{table}.total_value)
+                    IS DISTINCT FROM (EXCLUDED.total_orders, EXCLUDED.total_value)
+            """, {'date_from': date_from, 'date_to': date_to})
+            cur.execute(f"""
+                DELETE FROM aggregated.{table} r
+                WHERE r.{period_column} >= %(date_from)s
+                    AND r.{period_column} + INTERVAL '1 {period}' <= %(date_to)s
+                    AND NOT EXISTS (
+                        SELECT 1 FROM aggregated.daily_metrics d
+                        WHERE d.status = r.status AND d.payment_method = r.payment_method
+                            AND d.date >= r.{period_column} AND d.date < r.{period_column} + INTERVAL '1 {period}'
+                    )
+            """, {'date_from': date_from, 'date_to': date_to})
+
+def rebuild_boundary_rollups(conn, partitions):
+    """Recalcula as semanas e meses que atravessam o limite de alguma partição e apaga os que ficaram fora delas.
+
+    Chamado depois que todas as partições confirmaram, pois esses períodos somam dias de duas partições
+    (ou de uma partição e de fora da faixa reconstruída). Com partições mensais, são só as semanas que
+    viram o mês. Não faz commit.
+    """
+    boundaries = [date_from for date_from, _ in partitions] + [date_to for _, date_to in partitions[-1:]]
+    first, last = (boundaries[0], boundaries[-1]) if boundaries else (None, None)
+    with conn.cursor() as cur:
+        for table, period_column, period in ROLLUP_PERIODS:
+            # plan_partitions cobre todos os dias de daily_metrics: fora da faixa só há rollups órfãos
+            cur.execute(f"""
+                DELETE FROM aggregated.{table}
+                WHERE %(first)s::date IS NULL
+                    OR {period_column} + INTERVAL '1 {period}' <= %(first)s
+                    OR {period_column} >= %(last)s
+            """, {'first': first, 'last': last})
+            cur.execute(f"""
+                SELECT DISTINCT DATE_TRUNC('{period}', boundary)::date, (DATE_TRUNC('{period}', boundary) + INTERVAL '1 {period}')::date
+                FROM unnest(%s::date[]) AS boundary
+                WHERE DATE_TRUNC('{period}', boundary) <> boundary
+            """, (boundaries,))
+            for period_start, period_end in cur.fetchall():
+                rebuild_rollups(conn, period_start, period_end)
+
+def rebuild_total_metrics(conn):
+    """Recalcula aggregated.total_metrics inteira a partir de aggregated.monthly_metrics. Não faz commit."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM aggregated.total_metrics t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM aggregated.monthly_metrics m
+                WHERE m.status = t.status AND m.payment_method = t.payment_method
+            )
+        """)
+        cur.execute("""
+            INSERT INTO aggregated.total_metrics (status, payment_method, total_orders, total_value)
+            SELECT status, payment_method, SUM(total_orders), SUM(total_value)
+            FROM aggregated.monthly_metrics
+            GROUP BY status, payment_method
+            ORDER BY status, payment_method
+            ON CONFLICT (status, payment_method)
+            DO UPDATE SET
+                total_orders = EXCLUDED.total_orders,
+                total_value = EXCLUDED.total_value,
+                created_at = CURRENT_TIMESTAMP
+            WHERE (aggregated.total_metrics.total_orders, aggregated.total_metrics.total_value)
+                IS DISTINCT FROM (EXCLUDED.total_orders, EXCLUDED.total_value)
+        """)
+        print(f"✅ {cur.rowcount} linhas de aggregated.total_metrics atualizadas")
+
+def plan_partitions(conn, period):
+    """Lista as partições [início, fim) entre a primeira e a última data de raw_data.orders e daily_metrics.
 
-def run_transformation():
-    """Executa a transformação de dados"""
+    Os limites vêm de MIN/MAX (resolvidos pelos índices, sem varrer a tabela). Períodos que só existem
+    em daily_metrics entram para que os grupos deles sejam apagados.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH bounds AS (
+                SELECT MIN(DATE(created_at)) AS first_date, MAX(DATE(created_at)) AS last_date FROM raw_data.orders
+                UNION ALL
+                SELECT MIN(date), MAX(date) FROM aggregated.daily_metrics
+            )
+            SELECT p.start::date, (p.start + INTERVAL '1 {period}')::date
+            FROM (SELECT MIN(first_date) AS first_date, MAX(last_date) AS last_date FROM bounds) b,
+                generate_series(DATE_TRUNC('{period}', b.first_date), b.last_date, INTERVAL '1 {period}') AS p(start)
+            ORDER BY p.start
+        """)
+        return cur.fetchall()
+
+def record_partition(conn, date_from, **fields):
+    """Atualiza a linha de progresso da partição em aggregated.rebuild_partitions. Não faz commit."""
+    assignments = ", ".join(f"{name} = %s" for name in fields)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"UPDATE aggregated.rebuild_partitions SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE partition_start = %s",
+            (*fields.values(), date_from),
+        )
+
+def rebuild_partition(pool, date_from, date_to, until_id):
+    """Reagrega uma partição numa conexão própria e numa única transação.
+
+    Staging, upsert, remoção de grupos que sumiram, semanas e meses contidos na partição e a linha de
+    progresso são confirmados juntos: quem lê aggregated.daily_metrics vê a partição inteira antiga ou inteira nova.
+    """
+    started = time.perf_counter()
+    conn = pool.getconn()
     try:
-        # Conectar ao PostgreSQL
-        print("\n📡 Conectando ao PostgreSQL...")
-        conn = get_database_connection()
-        print("✅ Conectado ao PostgreSQL")
+        staged_groups = aggregate_data(conn, until_id=until_id, date_from=date_from, date_to=date_to)
+        result = insert_aggregated_data(conn, staged_groups)
+        result['deleted'] = delete_stale_groups(conn, date_from, date_to)
+        rebuild_rollups(conn, date_from, date_to) # semanas e meses da partição entram na mesma transação dos dias
+        result['groups'] = staged_groups
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        record_partition(conn, date_from, state='done', **result)
+        conn.commit()
+        PARTITION_SECONDS.observe(result['seconds'])
+        print(f"✅ Partição {date_from}: {staged_groups} grupos, {result['inserted']} inseridos, "
+              f"{result['updated']} atualizados, {result['deleted']} apagados ({result['seconds']}s)")
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+def run_partitioned_rebuild(timings):
+    """Reconstrução completa dividida em partições de REBUILD_PARTITION agregadas em paralelo.
+
+    Uma conexão coordenadora segura o advisory lock da transformação (em nível de sessão, pois
+    as partições rodam em outras conexões) e planeja as partições; REBUILD_WORKERS threads, cada
+    uma com sua conexão, reagregam as partições e confirmam cada uma separadamente. O progresso
+    fica em aggregated.rebuild_partitions. Semanas e meses contidos numa partição são recalculados
+    na transação dela; no fim, só os períodos que atravessam limites entre partições e o total geral
+    são recalculados, e a marca d'água avança. Se alguma partição falhar, as demais continuam
+    confirmadas, os rollups refletem o que foi gravado e a marca d'água não avança.
+    """
+    if REBUILD_PARTITION not in ('day', 'week', 'month', 'year'):
+        raise ValueError("REBUILD_PARTITION deve ser 'day', 'week', 'month' ou 'year'")
+    with ExitStack() as stack:
+        with timed_stage(timings, 'connect'):
+            conn = stack.enter_context(pooled_connection())
+        with timed_stage(timings, 'schema'):
+            ensure_aggregated_schema(conn)
         
-        # Configurar schema e tabela
-        print("\n🏗️  Configurando schema aggregated...")
-        setup_aggregated_schema(conn)
+        with timed_stage(timings, 'lock'), conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (TRANSFORM_LOCK_ID,))
+        stack.callback(release_session_lock, conn)
         
-        # Agregar dados
-        print("\n📊 Agregando dados de raw_data.orders...")
-        aggregated_data = aggregate_data(conn)
+        with timed_stage(timings, 'plan'):
+            max_order_id = get_max_order_id(conn) # pedidos que chegarem durante a reconstrução ficam para a próxima incremental
+            partitions = plan_partitions(conn, REBUILD_PARTITION)
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM aggregated.rebuild_partitions")
+                cur.executemany(
+                    "INSERT INTO aggregated.rebuild_partitions (partition_start, partition_end, state) VALUES (%s, %s, 'pending')",
+                    partitions,
+                )
+            conn.commit()
+        print(f"\n📊 Reconstruindo {len(partitions)} partições ({REBUILD_PARTITION}) com {REBUILD_WORKERS} workers...")
         
-        # Inserir dados agregados
-        print("\n💾 Inserindo dados agregados em aggregated.daily_metrics...")
-        inserted = insert_aggregated_data(conn, aggregated_data)
-        print(f"✅ {inserted} registros inseridos/atualizados com sucesso")
+        result = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+        failed = []
+        with timed_stage(timings, 'partitions'):
+            workers = max(1, min(REBUILD_WORKERS, len(partitions)))
+            pool = ThreadedConnectionPool(0, workers, get_database_url()) # conexões só da reconstrução, fechadas no fim
+            try:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rebuild') as executor:
+                    futures = {
+                        executor.submit(rebuild_partition, pool, date_from, date_to, max_order_id): date_from
+                        for date_from, date_to in partitions
+                    }
+                    for future in as_completed(futures):
+                        date_from = futures[future]
+                        try:
+                            partition_result = future.result()
+                        except Exception as e:
+                            print(f"❌ Partição {date_from} falhou: {e}")
+                            failed.append(str(date_from))
+                            record_partition(conn, date_from, state='error', error=str(e))
+                            conn.commit()
+                            continue
+                        for key in result:
+                            result[key] += partition_result[key]
+            finally:
+                pool.closeall()
         
-        # Fechar conexão com o banco de dados
-        conn.close()
+        print("\n📈 Recalculando rollups na fronteira das partições e totais...")
+        with timed_stage(timings, 'rollups'):
+            rebuild_boundary_rollups(conn, partitions)
+            rebuild_total_metrics(conn)
+        if not failed:
+            save_watermark(conn, max_order_id)
+        with timed_stage(timings, 'commit'):
+            conn.commit()
+        if failed:
+            raise RuntimeError(f"partições com erro: {', '.join(sorted(failed))}")
+        return dict(result, partitions=len(partitions))
+
+def release_session_lock(conn):
+    """Libera o advisory lock de sessão da reconstrução particionada"""
+    if conn.closed:
+        return
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (TRANSFORM_LOCK_ID,))
+    conn.commit()
+
+def get_rebuild_progress(conn):
+    """Retorna o progresso da última reconstrução particionada, uma entrada por partição"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT partition_start, partition_end, state, groups, inserted, updated, unchanged, deleted, seconds, error, updated_at
+            FROM aggregated.rebuild_partitions
+            ORDER BY partition_start
+        """)
+        columns = [column.name for column in cur.description]
+        rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+    conn.rollback()
+    for row in rows:
+        for key in ('partition_start', 'partition_end', 'updated_at'):
+            row[key] = row[key].isoformat()
+        if row['seconds'] is not None:
+            row['seconds'] = float(row['seconds'])
+    return rows
+
+@contextmanager
+def timed_stage(timings, stage):
+    """Mede a etapa no histograma transformer_stage_seconds e guarda a duração em timings[stage]"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings[stage] = round(elapsed, 4)
+
+def run_transformation(full_rebuild=False, partitioned=False):
+    """Executa a transformação de dados.
+
+    Por padrão é incremental: só reagrega os grupos tocados por pedidos com id acima da marca
+    d'água. full_rebuild=True (ou a primeira execução) reagrega raw_data.orders inteira.
+    partitioned=True faz a reconstrução completa em partições paralelas (ver run_partitioned_rebuild).
+    """
+    timings = {} # duração de cada etapa, em segundos
+    mode = 'partitioned' if partitioned else 'full' if full_rebuild else 'incremental'
+    started = time.perf_counter()
+    try:
+        if partitioned:
+            result = run_partitioned_rebuild(timings)
+        else:
+            result = run_single_transformation(full_rebuild, timings)
         
+        for key in ('inserted', 'updated', 'unchanged'):
+            GROUPS.labels(key).inc(result[key])
+        RUNS.labels(mode, 'success').inc()
         print("\n=== Transformação concluída com sucesso ===")
-        return inserted # retorna o número de linhas inseridas
+        return dict(result, timings=timings) # retorna as contagens de inseridos/atualizados/inalterados e os tempos
         
     except Exception as e:
+        RUNS.labels(mode, 'error').inc()
         print(f"\n❌ Erro: {e}")
         raise
+    finally:
+        elapsed = time.perf_counter() - started
+        RUN_SECONDS.labels(mode).observe(elapsed)
+        timings['total'] = round(elapsed, 4)
+
+def run_single_transformation(full_rebuild, timings):
+    """Transformação incremental ou completa numa única conexão e numa única transação"""
+    with ExitStack() as stack:
+        with timed_stage(timings, 'connect'):
+            conn = stack.enter_context(pooled_connection()) # conexão emprestada do pool do processo
+        with timed_stage(timings, 'schema'):
+            ensure_aggregated_schema(conn)
+        
+        # Uma transformação por vez em todo o serviço: o lock vale até o commit/rollback desta transação
+        with timed_stage(timings, 'lock'), conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (TRANSFORM_LOCK_ID,))
+        
+        # Definir a faixa de pedidos a agregar
+        with timed_stage(timings, 'watermark'):
+            watermark = get_watermark(conn)
+            max_order_id = get_max_order_id(conn)
+        if not full_rebuild and watermark >= max_order_id:
+            print(f"\n✅ Nenhum pedido novo desde o id {watermark}, nada a agregar")
+            conn.rollback() # libera o lock
+            result = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        else:
+            # Agregar dados
+            with timed_stage(timings, 'aggregate'):
+                if full_rebuild or watermark == 0:
+                    print("\n📊 Agregando dados de raw_data.orders (reconstrução completa)...")
+                    staged_groups = aggregate_data(conn)
+                else:
+                    print(f"\n📊 Agregando grupos tocados por pedidos com id em ({watermark}, {max_order_id}]...")
+                    staged_groups = aggregate_data(conn, since_id=watermark, until_id=max_order_id)
+            
+            # A marca d'água é gravada na mesma transação do upsert
+            save_watermark(conn, max_order_id)
+            
+            # Inserir dados agregados
+            print("\n💾 Inserindo dados agregados em aggregated.daily_metrics...")
+            with timed_stage(timings, 'upsert'):
+                result = insert_aggregated_data(conn, staged_groups)
+            print(f"✅ {result['inserted']} inseridos, {result['updated']} atualizados, {result['unchanged']} inalterados")
+            
+            # Atualizar rollups semanais, mensais e totais na mesma passada
+            if staged_groups:
+                print("\n📈 Atualizando rollups semanais, mensais e totais...")
+                with timed_stage(timings, 'rollups'):
+                    update_rollups(conn)
+            
+            with timed_stage(timings, 'commit'):
+                conn.commit() # confirma a transação: daily_metrics, rollups e marca d'água ficam visíveis juntos
+    return result
+
+def utc_now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+class TransformScheduler: # agrupa os gatilhos de /transform em execuções, uma por vez
+    """Executa as transformações disparadas via HTTP numa thread própria, uma por vez no processo.
+
+    Cada gatilho entra na execução pendente (criando-a se não houver). A pendente só começa depois de
+    debounce_seconds sem gatilhos novos (no máximo max_wait_seconds após o primeiro) e quando a
+    execução em andamento termina; gatilhos que chegam durante uma execução formam uma única
+    reexecução atrás dela. Entre processos, o advisory lock de run_transformation continua valendo.
+    Cada mudança de estado é copiada para aggregated.transform_runs, de onde get() lê as execuções
+    agendadas por outros workers.
+    """
+
+    def __init__(self, debounce_seconds, max_wait_seconds, ttl_seconds):
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.ttl_seconds = ttl_seconds
+        self.runs = {} # run_id -> estado da execução
+        self.pending = None # execução aguardando a janela; recebe os gatilhos novos
+        self.running = None # execução em andamento
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def submit(self, mode):
+        """Registra um gatilho. Retorna (execução em que ele foi agrupado, True se ela já existia)"""
+        now = time.monotonic()
+        with self.condition:
+            self.start_thread()
+            self.prune(now)
+            run = self.pending
+            coalesced = run is not None
+            if coalesced:
+                run['triggers'] += 1
+                if MODE_PRIORITY[mode] > MODE_PRIORITY[run['mode']]: # ex.: incremental + full vira full
+                    run['mode'] = mode
+                run['_due'] = min(now + self.debounce_seconds, run['_first_trigger'] + self.max_wait_seconds)
+            else:
+                run = {
+                    'id': uuid.uuid4().hex,
+                    'mode': mode,
+                    'state': 'queued', # queued -> running -> succeeded | failed
+                    'triggers': 1,
+                    'created_at': utc_now_iso(),
+                    'started_at': None,
+                    'finished_at': None,
+                    'queue_seconds': None,
+                    'run_seconds': None,
+                    'result': None,
+                    'error': None,
+                    '_first_trigger': now,
+                    '_due': now + self.debounce_seconds,
+                    '_started': None,
+                    '_finished': None,
+                }
+                self.runs[run['id']] = run
+                self.pending = run
+            self.condition.notify_all()
+            public = self.public(run)
+        if not coalesced:
+            self.persist(public)
+        TRIGGERS.labels('coalesced' if coalesced else 'scheduled').inc()
+        return run, coalesced
+
+    def start_thread(self):
+        """Inicia a thread do agendador no primeiro gatilho (depois do fork do gunicorn). Chamada com condition"""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.loop, name='transform-scheduler', daemon=True)
+            self.thread.start()
+
+    def prune(self, now):
+        """Remove execuções finalizadas há mais de ttl_seconds. Chamada com condition"""
+        cutoff = now - self.ttl_seconds
+        for run_id in [run_id for run_id, run in self.runs.items() if run['_finished'] and run['_finished'] < cutoff]:
+            del self.runs[run_id]
+
+    def loop(self):
+        """Espera a janela da execução pendente terminar e a executa, para sempre"""
+        while True:
+            with self.condition:
+                while self.pending is None or self.pending['_due'] > time.monotonic():
+                    self.condition.wait(None if self.pending is None else self.pending['_due'] - time.monotonic())
+                run, self.pending = self.pending, None # gatilhos novos passam a formar a próxima execução
+                self.running = run
+                run['state'] = 'running'
+                run['started_at'] = utc_now_iso()
+                run['_started'] = time.monotonic()
+                run['queue_seconds'] = round(run['_started'] - run['_first_trigger'], 3)
+                public = self.public(run)
+            self.persist(public)
+            QUEUE_SECONDS.observe(run['_started'] - run['_first_trigger'])
+            self.execute(run)
+
+    def execute(self, run):
+        """Roda a transformação da execução e registra resultado ou erro"""
+        mode = run['mode']
+        print(f"\n=== Transformação {run['id']} iniciada (modo {mode}, {run['triggers']} gatilho(s)) ===")
+        result, error = None, None
+        try:
+            result = run_transformation(full_rebuild=(mode == 'full'), partitioned=(mode == 'partitioned'))
+        except Exception as e: # o erro já foi logado por run_transformation; fica registrado na execução
+            error = str(e)
+        with self.condition:
+            run['state'] = 'failed' if error else 'succeeded'
+            run['result'] = result
+            run['error'] = error
+            run['finished_at'] = utc_now_iso()
+            run['_finished'] = time.monotonic()
+            run['run_seconds'] = round(run['_finished'] - run['_started'], 3)
+            self.running = None
+            self.condition.notify_all() # acorda quem espera o resultado (?wait=true)
+            public = self.public(run)
+        self.persist(public)
+
+    @staticmethod
+    def public(run):
+        """Cópia pública da execução (sem os campos internos, prefixo _). Chamada com condition"""
+        return {k: v for k, v in run.items() if not k.startswith('_')}
+
+    def persist(self, public):
+        """Grava a cópia pública em aggregated.transform_runs e apaga as finalizadas há mais de ttl_seconds.
+
+        Uma gravação atrasada de 'queued' não sobrescreve um estado posterior. Falhas só são logadas:
+        a execução continua consultável neste worker.
+        """
+        try:
+            with pooled_connection() as conn:
+                ensure_aggregated_schema(conn)
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO aggregated.transform_runs (id, state, run)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (id) DO UPDATE SET
+                            state = EXCLUDED.state,
+                            run = EXCLUDED.run,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE aggregated.transform_runs.state = 'queued' OR EXCLUDED.state IN ('succeeded', 'failed')
+                    """, (public['id'], public['state'], Json(public)))
+                    if public['state'] in ('succeeded', 'failed'):
+                        cur.execute("""
+                            DELETE FROM aggregated.transform_runs
+                            WHERE state IN ('succeeded', 'failed') AND updated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                        """, (self.ttl_seconds,))
+                conn.commit()
+        except Exception as e:
+            print(f"⚠️  Erro ao gravar a execução {public['id']} em aggregated.transform_runs: {e}")
+
+    def get(self, run_id):
+        """Cópia pública da execução ou None; execuções de outros workers vêm de aggregated.transform_runs"""
+        with self.condition:
+            run = self.runs.get(run_id)
+            if run is not None:
+                return self.public(run)
+        with pooled_connection() as conn:
+            ensure_aggregated_schema(conn)
+            with conn.cursor() as cur:
+                cur.execute("SELECT run FROM aggregated.transform_runs WHERE id = %s", (run_id,))
+                row = cur.fetchone()
+            conn.rollback()
+        return row[0] if row else None
+
+    def wait(self, run_id, timeout=None):
+        """Bloqueia até a execução terminar e retorna sua cópia pública"""
+        with self.condition:
+            run = self.runs[run_id]
+            self.condition.wait_for(lambda: run['state'] in ('succeeded', 'failed'), timeout)
+        return self.get(run_id)
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                'pending_run': self.pending and self.pending['id'],
+                'running_run': self.running and self.running['id'],
+                'runs': len(self.runs),
+                'debounce_seconds': self.debounce_seconds,
+            }
+
+transform_scheduler = TransformScheduler(TRANSFORM_DEBOUNCE_SECONDS, TRANSFORM_DEBOUNCE_MAX_SECONDS, TRANSFORM_RUN_TTL_SECONDS)
 
 # Criar aplicação Flask
 app = Flask(__name__) # flask é um framework da API para Python
@@ -152,20 +1009,96 @@ def hello():
 
 @app.route('/health') # rota get para o health check
 def health():
-    return {'status': 'healthy'}, 200
+    return {'status': 'healthy', 'scheduler': transform_scheduler.snapshot()}, 200
+
+@app.route('/metrics') # rota get para as métricas no formato Prometheus
+def metrics():
+    """Métricas no formato Prometheus; com gunicorn agrega os valores de todos os workers"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
 
-@app.route('/transform', methods=['POST']) #rota post para executar a transformação
+@app.route('/transform', methods=['POST']) #rota post para agendar a transformação
 def transform():
-    """Endpoint HTTP para executar a transformação"""
-    try:
-        print("\n=== Transformação disparada via HTTP ===")
-        inserted = run_transformation() # executa a transformação e retorna o número de linhas inseridas
+    """Endpoint HTTP para agendar a transformação.
+
+    Responde 202 na hora com o id da execução em que o gatilho foi agrupado (ver TransformScheduler);
+    o resultado é consultado em GET /transform/runs/<id>.
+    Incremental por padrão; ?mode=full (ou {"mode": "full"} no corpo) força a reconstrução completa
+    e ?mode=partitioned a reconstrução completa em partições paralelas (progresso em GET /transform/partitions).
+    ?wait=true espera a execução terminar e responde com as contagens do upsert;
+    com ?timings=true essa resposta inclui a duração de cada etapa.
+    """
+    body = request.get_json(silent=True) or {}
+    mode = request.args.get('mode') or body.get('mode') or 'incremental'
+    if mode not in MODE_PRIORITY:
+        return jsonify({
+            'success': False,
+            'error': "mode deve ser 'incremental', 'full' ou 'partitioned'"
+        }), 400
+    run, coalesced = transform_scheduler.submit(mode)
+    print(f"\n=== Transformação disparada via HTTP (modo {mode}, execução {run['id']}{', agrupada' if coalesced else ''}) ===")
+    
+    if request.args.get('wait', '').lower() not in ('1', 'true', 'yes'):
         return jsonify({
             'success': True,
-            'message': 'Transformação executada com sucesso',
-            'inserted': inserted
-        }), 200
-    except Exception as e: # se houver erro, retorna o erro
+            'message': 'Transformação agendada',
+            'run_id': run['id'],
+            'mode': run['mode'],
+            'state': run['state'],
+            'coalesced': coalesced,
+            'status_url': f"/transform/runs/{run['id']}",
+        }), 202
+    
+    run = transform_scheduler.wait(run['id'])
+    if run['state'] == 'failed': # se houver erro, retorna o erro
+        return jsonify({
+            'success': False,
+            'run_id': run['id'],
+            'error': run['error']
+        }), 500
+    result = run['result']
+    response = {
+        'success': True,
+        'message': 'Transformação executada com sucesso',
+        'run_id': run['id'],
+        'mode': run['mode'],
+        'inserted': result['inserted'],
+        'updated': result['updated'],
+        'unchanged': result['unchanged']
+    }
+    if run['mode'] == 'partitioned':
+        response['deleted'] = result['deleted']
+        response['partitions'] = result['partitions']
+    if request.args.get('timings', '').lower() in ('1', 'true', 'yes'):
+        response['timings'] = result['timings']
+    return jsonify(response), 200
+
+@app.route('/transform/runs/<run_id>') # rota get para o estado de uma execução agendada
+def transform_run(run_id):
+    """Estado, gatilhos agrupados, tempos e resultado de uma execução agendada por POST /transform"""
+    try:
+        run = transform_scheduler.get(run_id)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if run is None:
+        return jsonify({'success': False, 'error': 'Execução não encontrada'}), 404
+    return jsonify(run), 200
+
+@app.route('/transform/partitions') # rota get para o progresso da reconstrução particionada
+def transform_partitions():
+    """Progresso da última reconstrução particionada: estado, contagens e duração de cada partição"""
+    try:
+        with pooled_connection() as conn:
+            ensure_aggregated_schema(conn)
+            partitions = get_rebuild_progress(conn)
+        states = {}
+        for partition in partitions:
+            states[partition['state']] = states.get(partition['state'], 0) + 1
+        return jsonify({'partitions': partitions, 'states': states}), 200
+    except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
@@ -181,10 +1114,13 @@ def main():
         raise
 
 if __name__ == '__main__':
-    # Se executado diretamente (não via import), iniciar servidor HTTP
+    # Se executado diretamente (não via import), iniciar servidor HTTP de desenvolvimento.
+    # Em produção o serviço roda no gunicorn (ver Dockerfile)
     port = int(os.getenv('PORT', '8080'))
     print(f"\n🚀 Servidor HTTP iniciado na porta {port}")
     print("Endpoints disponíveis:")
     print("  - GET  /health    - Health check")
-    print("  - POST /transform  - Executar transformação")
+    print("  - GET  /metrics   - Métricas Prometheus")
+    print("  - POST /transform  - Agendar transformação (?mode=full para reconstrução completa, ?wait=true para esperar)")
+    print("  - GET  /transform/runs/<id> - Estado de uma transformação agendada")
     app.run(host='0.0.0.0', port=port, debug=False)